@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Cost of changing an auth file of 100000 users: the time for a
+single `update` and a single `remove`, each the median of several
+runs, and the time to make a batch of 100 updates, 100 removals and
+1000 additions. The batch is made in one `apply` where the package has
+it, and one user at a time otherwise. The same users are chosen on
+every run.
+
+Usage: python bench/auth_file.py [REVISION]
+"""
+
+from os.path import join as path_join
+from random import Random
+from shutil import copyfile, rmtree
+from tempfile import mkdtemp
+
+from common import label, median, revision, timer, use_source
+
+
+USERS = 100000
+REPEATS = 5
+UPDATES = 100
+REMOVALS = 100
+ADDITIONS = 1000
+
+
+def write_users(file_name):
+    from n4.auth import AuthUser
+    with open(file_name, "wb") as f:
+        for i in range(USERS):
+            f.write(AuthUser.create(u"user%d" % i, u"password").dump())
+
+
+def operations():
+    chosen = Random(1).sample(range(USERS), UPDATES + REMOVALS)
+    return ([("update", u"user%d" % i, u"changed") for i in chosen[:UPDATES]] +
+            [("remove", u"user%d" % i, None) for i in chosen[UPDATES:]] +
+            [("add", u"new%d" % i, u"password") for i in range(ADDITIONS)])
+
+
+def measure_single(base, file_name, change):
+    clock = timer()
+    times = []
+    for i in range(REPEATS):
+        copyfile(base, file_name)
+        t0 = clock()
+        change(u"user%d" % (i * (USERS // REPEATS)))
+        times.append(clock() - t0)
+    return median(times)
+
+
+def measure_batch(base, file_name, ops):
+    from n4.auth import AuthFile
+    clock = timer()
+    copyfile(base, file_name)
+    auth_file = AuthFile(file_name)
+    t0 = clock()
+    if hasattr(auth_file, "apply"):
+        auth_file.apply(ops)
+    else:
+        for action, user_name, password in ops:
+            if action == "add":
+                auth_file.append(user_name, password)
+            elif action == "remove":
+                auth_file.remove(user_name)
+            else:
+                auth_file.update(user_name, password)
+    return clock() - t0
+
+
+def main():
+    rev = revision()
+    use_source(rev)
+    from n4.auth import AuthFile
+    path = mkdtemp(prefix="n4-bench-")
+    try:
+        base = path_join(path, "base")
+        file_name = path_join(path, "auth")
+        write_users(base)
+        update_time = measure_single(base, file_name, lambda user_name: AuthFile(file_name).update(user_name, u"x"))
+        remove_time = measure_single(base, file_name, lambda user_name: AuthFile(file_name).remove(user_name))
+        batch_time = measure_batch(base, file_name, operations())
+    finally:
+        rmtree(path, True)
+    print(label(rev))
+    print("  update 1 of {} users:     {:>7.3f} s".format(USERS, update_time))
+    print("  remove 1 of {} users:     {:>7.3f} s".format(USERS, remove_time))
+    print("  {} updates, {} removals, {} additions: {:>7.3f} s".format(UPDATES, REMOVALS, ADDITIONS, batch_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Helpers shared by the benchmark scripts.
+"""
+
+from os.path import abspath, dirname
+from shutil import rmtree
+from subprocess import check_call, PIPE, Popen
+import sys
+from tempfile import mkdtemp
+
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+
+def source_path(rev=None):
+    """ Find a directory from which the `n4` package can be imported,
+    extracting it as it was at a git revision if one is given. The
+    extracted copy is removed when the process exits.
+
+    :param rev: git revision, or :const:`None` for the working tree
+    :returns: directory to put first on the module path
+    """
+    if not rev:
+        return ROOT
+    import atexit
+    path = mkdtemp(prefix="n4-bench-")
+    atexit.register(rmtree, path, True)
+    archive = Popen(["git", "archive", rev, "n4"], cwd=ROOT, stdout=PIPE)
+    check_call(["tar", "-x", "-C", path], stdin=archive.stdout)
+    archive.stdout.close()
+    if archive.wait() != 0:
+        raise SystemExit("Cannot read revision {!r}".format(rev))
+    return path
+
+
+def use_source(rev=None):
+    """ Make `import n4` load the package from the working tree, or as
+    it was at a git revision.
+    """
+    path = source_path(rev)
+    sys.path.insert(0, path)
+    return path
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def timer():
+    try:
+        from time import perf_counter
+    except ImportError:
+        from time import time as perf_counter
+    return perf_counter
+
+
+def revision():
+    """ Read the git revision to measure from the command line, if any.
+    Compare two revisions by running a script once for each.
+    """
+    return sys.argv[1] if len(sys.argv) > 1 else None
+
+
+def label(rev):
+    return "n4 at {}".format(rev) if rev else "n4 in the working tree"
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Start-up time of the command line tool, as the time taken to import
+`n4.__main__` and the time from process start until a single statement
+given on the command line has finished. A stub driver stands in for the
+server, so no database is needed and only the client is measured. Each
+figure is the median of several runs in fresh processes.
+
+Usage: python bench/startup.py [REVISION]
+"""
+
+from os import devnull, environ, pathsep
+from subprocess import check_output
+import sys
+from time import time
+
+from common import label, median, revision, source_path
+
+
+RUNS = 10
+
+IMPORT = """
+from timeit import default_timer as timer
+t0 = timer()
+import n4.__main__
+print("elapsed", timer() - t0)
+"""
+
+FIRST_QUERY = """
+from time import time
+from neo4j.v1 import GraphDatabase
+
+
+class Server(object):
+    address = ("127.0.0.1", 7687)
+
+
+class Summary(object):
+    server = Server()
+    statement_type = "r"
+    result_available_after = 0
+    result_consumed_after = 0
+
+
+class Record(object):
+
+    def __init__(self, keys, values):
+        self._keys = keys
+        self._values = values
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return list(self._values)
+
+    def __getitem__(self, key):
+        return self._values[key if isinstance(key, int) else self._keys.index(key)]
+
+
+class Result(object):
+
+    def __init__(self):
+        self._records = [Record(["1"], [1])]
+
+    def keys(self):
+        return ["1"]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._records:
+            raise StopIteration()
+        return self._records.pop(0)
+
+    next = __next__
+
+    def peek(self):
+        return self._records[0] if self._records else None
+
+    def summary(self):
+        return Summary()
+
+    def consume(self):
+        self._records = []
+        return Summary()
+
+    def detach(self):
+        return 0
+
+
+class Session(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def run(self, statement, parameters=None, **kwparameters):
+        return Result()
+
+    def close(self):
+        print("finished", time())
+
+    def last_bookmark(self):
+        return None
+
+
+class Driver(object):
+
+    def session(self, *args, **kwargs):
+        return Session()
+
+    def close(self):
+        pass
+
+
+GraphDatabase.driver = staticmethod(lambda *args, **kwargs: Driver())
+from n4.__main__ import repl
+repl.main(["RETURN 1"], standalone_mode=False)
+"""
+
+
+def run(code, path):
+    """ Run code in a fresh process, with `n4` imported from `path`, and
+    return the time at which it started along with the last value it
+    printed.
+    """
+    env = dict(environ)
+    env["PYTHONPATH"] = pathsep.join([path] + [p for p in [environ.get("PYTHONPATH")] if p])
+    with open(devnull, "w") as null:
+        t0 = time()
+        # Run from `path`, since a package in the current directory would take precedence
+        output = check_output([sys.executable, "-W", "ignore", "-c", code], cwd=path, env=env, stderr=null)
+    values = [line.split()[-1] for line in output.decode("utf-8").splitlines()
+              if line.startswith(("elapsed ", "finished "))]
+    return t0, float(values[-1])
+
+
+def main():
+    rev = revision()
+    path = source_path(rev)
+    import_times = [run(IMPORT, path)[1] for _ in range(RUNS)]
+    first_query_times = [t1 - t0 for t0, t1 in (run(FIRST_QUERY, path) for _ in range(RUNS))]
+    print(label(rev))
+    print("  import n4.__main__:             {:>6.0f} ms".format(median(import_times) * 1000))
+    print("  process start to first query:   {:>6.0f} ms".format(median(first_query_times) * 1000))
+
+
+if __name__ == "__main__":
+    main()
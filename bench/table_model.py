@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Cost of holding one large table page: the time to append 100000
+rows of ten mixed columns, the time to render them as unstyled text,
+and the memory held by the table once built. Times are the median of
+several runs; memory is measured in a separate run, since tracing
+allocations slows everything down.
+
+Usage: python bench/table_model.py [REVISION]
+"""
+
+import gc
+
+from common import label, median, revision, timer, use_source
+
+
+ROWS = 100000
+COLUMNS = 10
+REPEATS = 3
+
+
+def rows(count=ROWS):
+    return [(i, i * 1.5, u"name-%d" % i, None, i % 2 == 0, u"city %d" % (i % 100), -i, u"x" * (i % 30), 7, u"ok")
+            for i in range(count)]
+
+
+def build(data):
+    from n4.table import Table
+    table = Table([u"k%d" % column for column in range(COLUMNS)])
+    for values in data:
+        table.append(values)
+    return table
+
+
+def measure_time(data):
+    clock = timer()
+    append_times = []
+    render_times = []
+    for _ in range(REPEATS):
+        gc.collect()
+        t0 = clock()
+        table = build(data)
+        t1 = clock()
+        table.render({"fg": "cyan"}, False)
+        t2 = clock()
+        append_times.append(t1 - t0)
+        render_times.append(t2 - t1)
+    return median(append_times), median(render_times)
+
+
+def measure_memory(data):
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        table = build(data)
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del table
+    return size
+
+
+def main():
+    rev = revision()
+    use_source(rev)
+    data = rows()
+    append_time, render_time = measure_time(data)
+    memory = measure_memory(data)
+    print(label(rev))
+    print("  append {} rows:  {:>6.2f} s".format(ROWS, append_time))
+    print("  render:             {:>6.2f} s".format(render_time))
+    print("  table memory:       {}".format("n/a" if memory is None else "{:>6.1f} MB".format(memory / 1e6)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Rate at which table pages are built and written out, in rows per
+second, for short and long pages of five columns. Output goes to the
+null device, so this measures rendering rather than the terminal.
+
+Usage: python bench/table_render.py [REVISION]
+"""
+
+from os import devnull
+from random import Random
+import sys
+
+from common import label, median, revision, timer, use_source
+
+
+PAGE_SIZES = (50, 10000)
+ROWS = 20000
+REPEATS = 3
+
+
+def rows(count):
+    random = Random(0)
+    for i in range(count):
+        yield [i, random.random() * 1000, u"name-%d" % random.randint(0, 99999),
+               random.choice([True, False, None]), [random.randint(0, 9) for _ in range(3)]]
+
+
+def measure(page_size, rows_total=ROWS):
+    from n4.table import Table
+    data = list(rows(rows_total))
+    clock = timer()
+    stdout = sys.stdout
+    times = []
+    with open(devnull, "w") as null:
+        for _ in range(REPEATS):
+            sys.stdout = null
+            try:
+                t0 = clock()
+                for start in range(0, rows_total, page_size):
+                    table = Table(["id", "score", "name", "flag", "digits"])
+                    for values in data[start:start + page_size]:
+                        table.append(values)
+                    table.echo({"fg": "cyan"})
+                times.append(clock() - t0)
+            finally:
+                sys.stdout = stdout
+    return rows_total / median(times)
+
+
+def main():
+    rev = revision()
+    use_source(rev)
+    print(label(rev))
+    for page_size in PAGE_SIZES:
+        print("  {:>5}-row pages: {:>8.1f}k rows/s".format(page_size, measure(page_size) / 1000))
+
+
+if __name__ == "__main__":
+    main()
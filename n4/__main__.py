@@ -16,9 +16,12 @@
 # limitations under the License.
 
 
+from io import open as io_open
 from os import getenv
+import sys
 
 import click
+from neo4j.v1 import WRITE_ACCESS
 
 from .console import Console, ConsoleError
 from .meta import description, full_help
@@ -46,11 +49,117 @@ DEFAULT_NEO4J_PASSWORD = "password"
               is_flag=True,
               default=False,
               help="Show low level communication detail.")
+@click.option("-P", "--play",
+              multiple=True, metavar="PATTERN",
+              help="Run Cypher files matching a pattern in parallel.")
+@click.option("-W", "--workers",
+              type=int,
+              help="Set the number of concurrent sessions for playback or import.")
+@click.option("--logs",
+              metavar="DIR",
+              help="Write parallel playback output to per-file logs.")
+@click.option("-I", "--import", "import_",
+              nargs=2, metavar="FILE STATEMENT",
+              help="Load rows from a CSV file in batches using an UNWIND statement.")
+@click.option("-B", "--batch-size",
+              type=int, default=1000,
+              help="Set the number of rows per import batch.")
+@click.option("--param",
+              multiple=True, metavar="NAME=VALUE",
+              help="Set a query parameter from a Cypher expression.")
+@click.option("--page-size",
+              type=int,
+              help="Set a fixed number of records per output page.")
+@click.option("-f", "--file", "script",
+              metavar="FILE",
+              help="Run statements from a file, or from stdin if FILE is '-'.")
+@click.option("-e", "--exit-on-error",
+              is_flag=True,
+              default=False,
+              help="Stop at the first failed statement when running a file.")
+@click.option("--progress",
+              metavar="FILE",
+              help="Write JSON progress for each statement run from a file ('-' for stderr).")
+@click.option("--pipeline",
+              is_flag=True,
+              default=False,
+              help="Send runs of statements together, reading results afterwards.")
+@click.option("--cache", "cache_ttl",
+              type=float, metavar="SECONDS",
+              help="Cache read results for a number of seconds.")
+@click.option("--cache-dir",
+              metavar="DIR",
+              help="Keep cached results in a directory, for reuse by later runs.")
+@click.option("--retries",
+              type=int,
+              help="Set the number of times to retry after a transient error.")
+@click.option("--trace", "trace_file",
+              metavar="FILE",
+              help="Record protocol activity and write it to a file on exit.")
+@click.option("--metrics",
+              metavar="FILE",
+              help="Write session statistics to a file on exit (JSON if FILE ends with .json, "
+                   "otherwise Prometheus text).")
+@click.option("--metrics-interval",
+              type=float, metavar="SECONDS",
+              help="Also write session statistics at a regular interval.")
 @click.argument("statement", nargs=-1)
-def repl(statement, uri, user, password, insecure, verbose):
+def repl(statement, uri, user, password, insecure, verbose, play, workers, logs, import_, batch_size, param,
+         page_size, script, exit_on_error, progress, pipeline, cache_ttl, cache_dir, retries, trace_file,
+         metrics, metrics_interval):
     try:
         console = Console(uri, auth=(user, password), secure=not insecure, verbose=verbose)
-        if statement:
+        console.page_size = page_size
+        console.pipeline = pipeline
+        if retries is not None:
+            console.retry_policy.retries = retries
+        if trace_file:
+            console.start_trace()
+        if metrics:
+            console.start_stats()
+            if metrics_interval:
+                from .stats import StatsExporter
+                StatsExporter(console.stats, metrics, metrics_interval).start()
+        if cache_ttl is not None or cache_dir:
+            console.start_cache(ttl=cache_ttl, directory=cache_dir)
+        exit_status = 0
+        for declaration in param:
+            console.run(u"/param " + declaration)
+        if import_:
+            file_name, import_statement = import_
+            try:
+                console.load_csv(file_name, import_statement, batch=batch_size, workers=workers or 1)
+            except Exception as error:
+                click.secho("{}: {}".format(error.__class__.__name__, error), err=True)
+                exit_status = 1
+        if play:
+            if console.play_parallel(play, WRITE_ACCESS, workers=workers or 4, logs=logs):
+                exit_status = 1
+            if statement:
+                click.echo(u"")
+        if script:
+            if progress == "-":
+                progress_file = click.get_text_stream("stderr")
+            elif progress:
+                progress_file = open_or_fail(io_open, progress, "w", encoding="utf-8")
+            else:
+                progress_file = None
+            if script == "-":
+                f = getattr(sys.stdin, "buffer", sys.stdin)
+            else:
+                f = open_or_fail(open, script, "rb")
+            try:
+                if console.run_script(f, exit_on_error=exit_on_error, progress=progress_file):
+                    exit_status = 1
+            finally:
+                if f is not sys.stdin and f is not getattr(sys.stdin, "buffer", None):
+                    f.close()
+                if progress_file is not None and progress != "-":
+                    progress_file.close()
+        if statement and pipeline and not any(s.lstrip().startswith("/") for s in statement):
+            # Join the statements up so that they can be sent together
+            console.run(u";\n".join(s.strip().rstrip(u";") for s in statement))
+        elif statement:
             gap = False
             for s in statement:
                 if gap:
@@ -58,14 +167,28 @@ def repl(statement, uri, user, password, insecure, verbose):
                 console.run(s)
                 if not s.startswith("/"):
                     gap = True
-            exit_status = 0
-        else:
+        elif not (play or import_ or script):
             exit_status = console.loop()
     except ConsoleError as e:
         click.secho(e.args[0], err=True)
         exit_status = 1
+    else:
+        if trace_file:
+            with io_open(trace_file, "w", encoding="utf-8") as f:
+                console.dump_trace(f)
+        if metrics and console.stats is not None:
+            console.stats.export(metrics)
     exit(exit_status)
 
 
+def open_or_fail(opener, file_name, *args, **kwargs):
+    """ Open a file, raising a :class:`.ConsoleError` if it cannot be opened.
+    """
+    try:
+        return opener(file_name, *args, **kwargs)
+    except (IOError, OSError) as error:
+        raise ConsoleError(u"Cannot open {} ({})".format(file_name, error.strerror or error))
+
+
 if __name__ == "__main__":
     repl()
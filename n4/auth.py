@@ -16,11 +16,25 @@
 # limitations under the License.
 
 
+from collections import OrderedDict
+from contextlib import contextmanager
+from csv import reader as csv_reader
 from hashlib import sha256
+from os.path import isfile
 from random import randint
+import sys
 
 import click
 
+from .csvutil import open_csv, decode_row
+from .fileutil import atomic_write
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 
 def bstr(s):
     return s if isinstance(s, (bytes, bytearray)) else s.encode("utf-8")
@@ -93,6 +107,27 @@ class AuthUser(object):
         return m.digest() == self.digest
 
 
+@contextmanager
+def locked(file_name):
+    """ Hold an exclusive lock for a file. A separate lock file is used,
+    since the file itself is replaced rather than rewritten in place.
+    """
+    with open(file_name + ".lock", "ab") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
 class AuthFile(object):
 
     def __init__(self, name):
@@ -108,29 +143,113 @@ class AuthFile(object):
         if self.name == "-":
             click.echo(line.decode("utf-8"), nl=False)
         else:
-            with open(self.name, "ab") as f:
-                f.write(line)
+            with locked(self.name):
+                with open(self.name, "ab") as f:
+                    f.write(line)
 
     def remove(self, user_name):
-        with open(self.name, "rb") as f:
-            lines = [line for line in f.readlines() if not AuthUser.match(line, user_name)]
-        with open(self.name, "wb") as f:
-            f.writelines(lines)
+        self.apply([("remove", user_name, None)], strict=False, create=False)
 
     def update(self, user_name, password):
-        with open(self.name, "rb") as f:
-            lines = []
-            for line in f.readlines():
-                if AuthUser.match(line, user_name):
-                    lines.append(AuthUser.create(user_name, password).dump())
+        self.apply([("update", user_name, password)], strict=False, create=False)
+
+    def index(self):
+        """ Load the file as an ordered mapping of user name to entry.
+        Entries are kept as they are, with only the user name parsed.
+        """
+        entries = OrderedDict()
+        try:
+            f = open(self.name, "rb")
+        except IOError:
+            return entries
+        with f:
+            for line in f:
+                if not line.strip():
+                    continue
+                if not line.endswith(b"\n"):
+                    line += b"\r\n"
+                entries[line.partition(b":")[0]] = line
+        return entries
+
+    def apply(self, operations, strict=True, create=True):
+        """ Apply a batch of operations to the file in a single pass.
+
+        Each operation is a triple of (action, user name, password), where
+        the action is "add", "update", "set" (add or update) or "remove".
+        The file is locked while the operations are applied and then
+        replaced in one step, so it is never seen in part, and is left
+        untouched if any operation fails.
+
+        :param operations: iterable of operations
+        :param strict: fail on adding a user that already exists, or on
+                       updating or removing one that does not
+        :param create: start a new file if there is none, rather than fail
+        :returns: dictionary of counts of users added, updated and removed
+        """
+        if not create and not isfile(self.name):
+            # Checked before locking, so that no lock file is left beside nothing
+            raise IOError("No such auth file '%s'" % self.name)
+        counts = {"added": 0, "updated": 0, "removed": 0}
+        with locked(self.name):
+            entries = self.index()
+            for number, (action, user_name, password) in enumerate(operations, start=1):
+                if action not in ("add", "update", "set", "remove"):
+                    raise ValueError("Operation %d: unknown action '%s'" % (number, action))
+                name = bstr(user_name)
+                exists = name in entries
+                if (action == "add" and exists) or (action in ("update", "remove") and not exists):
+                    if strict:
+                        raise ValueError("Operation %d: user '%s' %s" % (
+                            number, name.decode("utf-8"), "already exists" if exists else "does not exist"))
+                elif action == "remove":
+                    del entries[name]
+                    counts["removed"] += 1
                 else:
-                    lines.append(line)
-        with open(self.name, "wb") as f:
+                    entries[name] = AuthUser.create(name, password).dump()
+                    counts["updated" if exists else "added"] += 1
+            self.save(entries.values())
+        return counts
+
+    def save(self, lines):
+        """ Replace the file with the given lines, by way of a temporary
+        file in the same directory.
+        """
+        with atomic_write(self.name, binary=True, sync=True) as f:
             f.writelines(lines)
 
 
+def read_operations(file_name, action=None):
+    """ Read operations from a CSV file, or from stdin if `file_name` is a
+    dash. Each row is either (action, user name, password), or just
+    (user name, password) if a single action is given for all rows.
+    Blank rows and rows starting with `#` are skipped.
+    """
+    f = sys.stdin if file_name == "-" else open_csv(file_name)
+    try:
+        for number, row in enumerate(csv_reader(f), start=1):
+            row = decode_row(row)
+            if not row or not row[0].strip() or row[0].startswith(u"#"):
+                continue
+            if action is None:
+                row_action, fields = row[0].strip().lower(), row[1:]
+            else:
+                row_action, fields = action, row
+            user_name = fields[0] if fields else u""
+            password = fields[1] if len(fields) > 1 else None
+            if not user_name or (password is None and row_action != "remove"):
+                raise ValueError("Line %d: expected a user name%s" % (
+                    number, "" if row_action == "remove" else " and password"))
+            yield row_action, user_name, password
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
 @click.group(help="""\
 Tool for managing Neo4j auth files.
+
+Commands that change AUTH_FILE hold a lock on AUTH_FILE.lock while they do so, to keep concurrent runs from
+overwriting each other's changes. The lock file is created beside the auth file if needed and is left in place.
 """)
 def cli():
     pass
@@ -190,6 +309,46 @@ def update(auth_file, user_name, password):
     AuthFile(auth_file).update(user_name, password)
 
 
+@cli.command("import", help="""\
+Add or update users in the Neo4j auth file from a CSV file.
+
+Each row of CSV_FILE holds a user name and password. Existing users are given the new password.
+All changes are made in a single write. If CSV_FILE contains only a dash `-` then rows are read from stdin.
+
+Example:
+
+    n4auth import data/dbms/auth users.csv
+""")
+@click.argument("auth_file")
+@click.argument("csv_file")
+def import_(auth_file, csv_file):
+    counts = AuthFile(auth_file).apply(read_operations(csv_file, "set"))
+    click.echo(summary_str(counts), err=True)
+
+
+@cli.command(help="""\
+Apply a list of changes to the Neo4j auth file.
+
+Each row of OPS_FILE holds an action, a user name and, except for `remove`, a password.
+The action is one of `add`, `update`, `set` (add or update) or `remove`.
+Nothing is written if any change cannot be made, such as adding a user that already exists.
+If OPS_FILE contains only a dash `-` then rows are read from stdin.
+
+Example:
+
+    n4auth apply data/dbms/auth changes.csv
+""")
+@click.argument("auth_file")
+@click.argument("ops_file")
+def apply(auth_file, ops_file):
+    counts = AuthFile(auth_file).apply(read_operations(ops_file))
+    click.echo(summary_str(counts), err=True)
+
+
+def summary_str(counts):
+    return u"{added} added, {updated} updated, {removed} removed".format(**counts)
+
+
 def main():
     try:
         cli(obj={})
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from math import ceil
+from threading import Lock, Thread
+from timeit import default_timer as timer
+
+
+def percentile(ordered, p):
+    """ Nearest-rank percentile of a sorted list of values.
+    """
+    if not ordered:
+        return 0.0
+    rank = max(0, int(ceil(p * len(ordered) / 100.0)) - 1)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class BenchmarkReport(object):
+    """ Outcome of a benchmark run.
+    """
+
+    def __init__(self, latencies, errors, elapsed, concurrency):
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+        self.concurrency = concurrency
+
+    @property
+    def count(self):
+        return len(self.latencies)
+
+    @property
+    def error_count(self):
+        return sum(count for count, _ in self.errors.values())
+
+    @property
+    def throughput(self):
+        return self.count / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, p):
+        return percentile(self.latencies, p)
+
+    @property
+    def mean(self):
+        return sum(self.latencies) / self.count if self.count else 0.0
+
+
+class Benchmark(object):
+    """ Load generator that runs a fixed sequence of statements
+    repeatedly from a number of concurrent sessions.
+
+    Each iteration runs every statement once, in order, consuming each
+    result in full. The latency of an iteration covers all of its
+    statements. A run stops after `count` iterations in total, or once
+    `duration` seconds have passed, whichever comes first.
+    """
+
+    def __init__(self, driver, statements, parameters=None, concurrency=1):
+        self.driver = driver
+        self.statements = list(statements)
+        self.parameters = parameters or {}
+        self.concurrency = max(1, concurrency)
+
+    def run(self, count=None, duration=None):
+        """ Run the benchmark.
+
+        :param count: total number of iterations to run
+        :param duration: maximum number of seconds to run for
+        :returns: :class:`.BenchmarkReport`
+        """
+        lock = Lock()
+        latencies = []
+        errors = {}
+        remaining = [count]
+        deadline = timer() + duration if duration else None
+
+        def claim():
+            with lock:
+                if deadline is not None and timer() >= deadline:
+                    return False
+                if remaining[0] is None:
+                    return True
+                if remaining[0] > 0:
+                    remaining[0] -= 1
+                    return True
+                return False
+
+        def work():
+            with self.driver.session() as session:
+                while claim():
+                    t0 = timer()
+                    try:
+                        for statement in self.statements:
+                            session.run(statement, self.parameters).consume()
+                    except Exception as error:
+                        key = error.__class__.__name__
+                        with lock:
+                            n, message = errors.get(key, (0, str(error)))
+                            errors[key] = (n + 1, message)
+                    else:
+                        latency = timer() - t0
+                        with lock:
+                            latencies.append(latency)
+
+        threads = [Thread(target=work) for _ in range(self.concurrency)]
+        t0 = timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return BenchmarkReport(latencies, errors, timer() - t0, self.concurrency)
@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from array import array
+import ast
+from heapq import nlargest
+from marshal import dumps, loads
+from mmap import mmap, ACCESS_READ
+import sys
+from tempfile import TemporaryFile
+
+from neo4j.v1.types import Node, Relationship, Path
+
+from .cache import CachedRecord
+from .data import json_default
+from .table import BOOLEAN, INTEGER, FLOAT, BYTES, STRING, LIST, MAP
+
+
+PY3 = sys.version_info >= (3,)
+
+#: Types of value that sort among themselves in the same way as by
+#: :func:`sort_key`, and so can be compared directly.
+NUMBER_TYPES = set((bool, int, float) if PY3 else (bool, int, long, float))
+STRING_TYPES = set([STRING])
+
+#: Array type code for offsets into the data of a buffer.
+OFFSET = "Q" if sys.version_info >= (3, 3) else "L"
+
+#: Kinds of syntax allowed in a filter expression: comparisons and
+#: arithmetic over columns and literals, combined with `and`, `or` and
+#: `not`. Anything else, such as calls and attribute access, is refused.
+FILTER_NODE_NAMES = [
+    "Expression", "BoolOp", "And", "Or", "UnaryOp", "Not", "UAdd", "USub",
+    "BinOp", "Add", "Sub", "Mult", "Div", "FloorDiv", "Mod",
+    "Compare", "Eq", "NotEq", "Lt", "LtE", "Gt", "GtE", "In", "NotIn", "Is", "IsNot",
+    "Name", "Load", "List", "Tuple", "Subscript", "Constant",
+]
+if sys.version_info < (3, 8):
+    FILTER_NODE_NAMES += ["Num", "Str", "Bytes", "NameConstant", "Index"]
+FILTER_NODES = tuple(getattr(ast, name) for name in FILTER_NODE_NAMES if hasattr(ast, name))
+
+
+def plain(value):
+    """ Convert a value to one built only from types that can be
+    serialised by :mod:`marshal`. Graph entities become maps, as they
+    do in JSON output, and other values without an equivalent become
+    strings.
+    """
+    if value is None or isinstance(value, (BOOLEAN, INTEGER, FLOAT, STRING)):
+        return value
+    elif isinstance(value, BYTES):
+        return bytes(value)
+    elif isinstance(value, (LIST, tuple)):
+        return [plain(item) for item in value]
+    elif isinstance(value, MAP):
+        return dict((key, plain(item)) for key, item in value.items())
+    elif isinstance(value, (Node, Relationship, Path)):
+        return plain(json_default(value))
+    else:
+        return STRING(value)
+
+
+def sort_key(value):
+    """ Key by which values of any type can be sorted together. Numbers
+    come first, then strings, then everything else, and finally nulls.
+    """
+    if value is None:
+        return 3, 0
+    elif isinstance(value, (BOOLEAN, INTEGER, FLOAT)):
+        return 0, value
+    elif isinstance(value, STRING):
+        return 1, value
+    else:
+        return 2, repr(value)
+
+
+def compile_filter(expression):
+    """ Compile an expression for use with :meth:`.ResultBuffer.filter`.
+    The expression is written in Python, but limited to the syntax in
+    :data:`FILTER_NODE_NAMES`.
+
+    :raises SyntaxError: if the expression cannot be parsed
+    :raises ValueError: if the expression uses other syntax
+    """
+    tree = ast.parse(expression, u"<filter>", "eval")
+    for node in ast.walk(tree):
+        if not isinstance(node, FILTER_NODES):
+            raise ValueError("Filters cannot contain {}".format(node.__class__.__name__))
+    return compile(tree, u"<filter>", "eval")
+
+
+class ResultBuffer(object):
+    """ Retained copy of a result, held by column so that operations on
+    one column need not touch the others.
+
+    Each value is serialised into a single block of data, which moves to
+    a temporary file, read back through a memory map, once it grows past
+    `spill_size` bytes. Each column holds the offset of each of its
+    values in that block. The values of a record are stored together, so
+    each one ends where the next begins.
+
+    Records are taken as they are written out, so a result that was not
+    read to the end is held only in part. The current view of the buffer
+    is a selection and ordering of its records, as left by sorting and
+    filtering.
+    """
+
+    #: Size of data, in bytes, past which it is moved to disk.
+    spill_size = 64 * 1024 * 1024
+
+    def __init__(self, keys, spill_size=None):
+        if spill_size is not None:
+            self.spill_size = int(spill_size)
+        self.keys = list(keys)
+        self.record_count = 0
+        #: Whether the whole result has been taken.
+        self.complete = False
+        self._offsets = [array(OFFSET) for _ in self.keys]
+        self._data = bytearray()
+        self._size = 0
+        self._file = None
+        self._map = None
+        self._view = None
+
+    def __len__(self):
+        return self.record_count if self._view is None else len(self._view)
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    @property
+    def size(self):
+        """ Total size of the data held, in bytes.
+        """
+        return self._size
+
+    def append(self, values):
+        """ Add a record to the buffer.
+        """
+        data = []
+        size = self._size
+        for offsets, value in zip(self._offsets, values):
+            offsets.append(size)
+            value = dumps(plain(value))
+            size += len(value)
+            data.append(value)
+        data = b"".join(data)
+        if self._file is None:
+            self._data += data
+        else:
+            self._file.write(data)
+        self._size = size
+        self.record_count += 1
+        if self._file is None and self._size > self.spill_size:
+            self._spill()
+
+    def retain(self, result):
+        """ Wrap a result so that records are added to the buffer as they
+        are read.
+        """
+        return RetainingResult(self, result)
+
+    def _spill(self):
+        self._file = TemporaryFile(prefix="n4-buffer-")
+        self._file.write(self._data)
+        self._data = None
+
+    def _block(self):
+        if self._file is None:
+            return self._data
+        if self._map is None or len(self._map) < self._size:
+            if self._map is not None:
+                self._map.close()
+            self._file.flush()
+            self._map = mmap(self._file.fileno(), self._size, access=ACCESS_READ)
+        return self._map
+
+    def raw(self, column, record):
+        """ Fetch a value in serialised form, which is the same for any
+        two equal values.
+        """
+        return bytes(self._slice(column, record))
+
+    def _slice(self, column, record):
+        if column + 1 < len(self._offsets):
+            end = self._offsets[column + 1][record]
+        elif record + 1 < self.record_count:
+            end = self._offsets[0][record + 1]
+        else:
+            end = self._size
+        return self._block()[self._offsets[column][record]:end]
+
+    def value(self, column, record):
+        return loads(self._slice(column, record) if PY3 else self.raw(column, record))
+
+    def column(self, column, records, raw=False):
+        """ Read the values of a column for a sequence of records, more
+        quickly than one at a time.
+
+        :param raw: read values in serialised form, as :meth:`raw` does
+        """
+        block = self._block()
+        starts = self._offsets[column]
+        if column + 1 < len(self._offsets):
+            ends = self._offsets[column + 1]
+        else:
+            ends = self._offsets[0][1:]
+            ends.append(self._size)
+        if raw:
+            return [bytes(block[starts[record]:ends[record]]) for record in records]
+        elif PY3:
+            return [loads(block[starts[record]:ends[record]]) for record in records]
+        else:
+            return [loads(bytes(block[starts[record]:ends[record]])) for record in records]
+
+    def values(self, record):
+        return [self.value(column, record) for column in range(len(self.keys))]
+
+    def column_index(self, column):
+        """ Find a column by name, or by number counting from 1.
+
+        :raises ValueError: if there is no such column
+        """
+        if column in self.keys:
+            return self.keys.index(column)
+        try:
+            index = int(column) - 1
+        except ValueError:
+            index = -1
+        if not 0 <= index < len(self.keys):
+            raise ValueError("Unknown column: {}".format(column))
+        return index
+
+    def records(self):
+        """ Record numbers in the current view, in order.
+        """
+        if self._view is None:
+            return range(self.record_count)
+        return self._view
+
+    def reset(self):
+        """ Return to a view of every record, in the order received.
+        """
+        self._view = None
+
+    def sort(self, columns):
+        """ Sort the current view.
+
+        :param columns: list of (column index, descending) pairs
+        """
+        records = self.records()
+        for column, descending in reversed(columns):
+            keys = self.column(column, records)
+            types = set(map(type, keys))
+            if not (types <= NUMBER_TYPES or types <= STRING_TYPES):
+                keys = [sort_key(value) for value in keys]
+            order = sorted(range(len(records)), key=keys.__getitem__, reverse=descending)
+            records = [records[i] for i in order]
+        self._view = array(OFFSET, records)
+
+    def filter(self, predicate):
+        """ Narrow the current view to the records for which a predicate
+        holds. The predicate is passed a :class:`.BufferedRow` for each
+        record, from which values are read only if used.
+        """
+        self._view = array(OFFSET, (record for record in self.records()
+                                    if predicate(BufferedRow(self, record))))
+
+    def top(self, n, column):
+        """ Find the records in the current view with the `n` greatest
+        values in a column, leaving the view as it is. Nulls come last.
+        """
+
+        records = self.records()
+        keys = [(-1, 0) if value is None else sort_key(value) for value in self.column(column, records)]
+        return [records[i] for i in nlargest(n, range(len(records)), key=keys.__getitem__)]
+
+    def count(self, column):
+        """ Count the records in the current view for each distinct value
+        in a column.
+
+        :returns: list of (value, count) pairs, most frequent first
+        """
+        counts = {}
+        for data in self.column(column, self.records(), raw=True):
+            counts[data] = counts.get(data, 0) + 1
+        return sorted(((loads(data), count) for data, count in counts.items()),
+                      key=lambda item: (-item[1], sort_key(item[0])))
+
+    def result(self, records=None):
+        """ Read records back, as a result that can be written out.
+
+        :param records: record numbers to read, or the current view if omitted
+        """
+        return RetainedResult(self, self.records() if records is None else records)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BufferedRow(object):
+    """ Mapping of column name to value for one buffered record, in which
+    values are read only on demand. The mapping itself is available as
+    `row`, for columns whose names are not valid identifiers.
+    """
+
+    def __init__(self, buffer, record):
+        self._buffer = buffer
+        self._record = record
+
+    def __getitem__(self, key):
+        if key == "row":
+            return self
+        try:
+            column = self._buffer.keys.index(key)
+        except ValueError:
+            raise KeyError(key)
+        return self._buffer.value(column, self._record)
+
+
+class RetainingResult(object):
+
+    def __init__(self, buffer, result):
+        self._buffer = buffer
+        self._result = result
+        self._records = iter(result)
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            record = next(self._records)
+        except StopIteration:
+            self._buffer.complete = True
+            raise
+        self._buffer.append(record.values())
+        return record
+
+    next = __next__
+
+    def peek(self):
+        record = self._result.peek()
+        if record is None:
+            self._buffer.complete = True
+        return record
+
+
+class RetainedResult(object):
+    """ Records read back from a buffer, offering the parts of the result
+    interface used for writing output.
+    """
+
+    def __init__(self, buffer, records):
+        self._buffer = buffer
+        self._records = records
+        self._index = 0
+
+    def keys(self):
+        return list(self._buffer.keys)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._index >= len(self._records):
+            raise StopIteration()
+        self._index += 1
+        return CachedRecord(self._buffer.keys, self._buffer.values(self._records[self._index - 1]))
+
+    next = __next__
+
+    def peek(self):
+        if self._index >= len(self._records):
+            return None
+        return CachedRecord(self._buffer.keys, self._buffer.values(self._records[self._index]))
+
+    def consume(self):
+        self._index = len(self._records)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import OrderedDict
+from glob import glob
+from hashlib import sha1
+from json import dumps as json_dumps
+from marshal import dump as marshal_dump, load as marshal_load
+from os import makedirs, remove
+from os.path import expanduser, isdir, join as path_join
+from threading import Lock
+from time import time
+from timeit import default_timer as timer
+
+from .fileutil import atomic_write
+
+
+class CachedRecord(object):
+
+    def __init__(self, keys, values):
+        self._keys = keys
+        self._values = values
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return list(zip(self._keys, self._values))
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._values[key]
+        return self._values[self._keys.index(key)]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+
+class CachedServer(object):
+
+    def __init__(self, address):
+        self.address = address
+
+
+class CachedSummary(object):
+    """ Stand-in for the summary of a result replayed from the cache.
+    No server time was spent, so none is reported.
+    """
+
+    cached = True
+    result_available_after = None
+    result_consumed_after = None
+
+    def __init__(self, statement, parameters, address):
+        self.statement = statement
+        self.parameters = parameters
+        self.server = CachedServer(address)
+
+
+class CacheEntry(object):
+
+    def __init__(self, keys, rows, summary, elapsed, expires):
+        self.keys = keys
+        self.rows = rows
+        self.summary = summary
+        self.elapsed = elapsed
+        self.expires = expires
+
+
+class BufferedResult(object):
+    """ Replay of a cached result, offering the parts of the result
+    interface used for writing output.
+    """
+
+    def __init__(self, entry):
+        self._keys = entry.keys
+        self._rows = entry.rows
+        self._summary = entry.summary
+        self._index = 0
+
+    def keys(self):
+        return list(self._keys)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._index >= len(self._rows):
+            raise StopIteration()
+        self._index += 1
+        return CachedRecord(self._keys, self._rows[self._index - 1])
+
+    next = __next__
+
+    def peek(self):
+        if self._index >= len(self._rows):
+            return None
+        return CachedRecord(self._keys, self._rows[self._index])
+
+    def summary(self):
+        return self._summary
+
+    def consume(self):
+        self._index = len(self._rows)
+        return self._summary
+
+
+class RecordingResult(object):
+    """ Wrapper for a result that collects records as they are read and
+    adds the whole result to the cache once it has been read in full.
+    Results with more than `max_rows` records are not kept.
+    """
+
+    def __init__(self, cache, key, result, started):
+        self._cache = cache
+        self._key = key
+        self._result = result
+        self._records = iter(result)
+        self._started = started
+        self._rows = []
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            record = next(self._records)
+        except StopIteration:
+            self._complete()
+            raise
+        if self._rows is not None:
+            if len(self._rows) < self._cache.max_rows:
+                self._rows.append(tuple(record.values()))
+            else:
+                self._rows = None
+        return record
+
+    next = __next__
+
+    def peek(self):
+        record = self._result.peek()
+        if record is None:
+            self._complete()
+        return record
+
+    def _complete(self):
+        if self._rows is not None:
+            self._cache.put(self._key, self._result.keys(), self._rows,
+                            self._result.summary(), timer() - self._started)
+            self._rows = None
+
+
+class ResultCache(object):
+    """ Least-recently-used cache of read results, held in memory and,
+    optionally, in a directory shared between processes.
+
+    Entries are keyed on normalised statement text and parameters, as
+    well as on `scope`, which should name the server and user so that
+    processes sharing a directory never see each other's results. They
+    expire `ttl` seconds after being stored.
+
+    Files are written with :mod:`marshal`, so results holding values of
+    other types, such as graph entities, are kept in memory only. Any
+    file that cannot be read back is treated as a miss.
+    """
+
+    #: Maximum number of entries held in memory.
+    capacity = 100
+
+    #: Seconds for which an entry remains valid.
+    ttl = 60.0
+
+    #: Largest result, in records, that will be kept.
+    max_rows = 10000
+
+    def __init__(self, capacity=None, ttl=None, max_rows=None, directory=None, scope=u""):
+        if capacity is not None:
+            self.capacity = int(capacity)
+        if ttl is not None:
+            self.ttl = float(ttl)
+        if max_rows is not None:
+            self.max_rows = int(max_rows)
+        self.directory = expanduser(directory) if directory else None
+        self.scope = scope
+        if self.directory and not isdir(self.directory):
+            makedirs(self.directory)
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.saved_time = 0.0
+
+    def key(self, statement, parameters):
+        """ Build a cache key from a normalised statement and its parameters.
+        """
+        return self.scope + u"\n" + statement + u"\n" + json_dumps(parameters, sort_keys=True, default=repr)
+
+    def _file_name(self, key):
+        return path_join(self.directory, sha1(key.encode("utf-8")).hexdigest() + ".n4cache")
+
+    def get(self, key):
+        """ Look up a result.
+
+        :returns: :class:`.BufferedResult` or :const:`None`
+        """
+        now = time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry.expires <= now:
+                entry = None
+            if entry is None and self.directory:
+                entry = self._load(key, now)
+                if entry is not None:
+                    self.disk_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self._evict()
+            self.hits += 1
+            self.saved_time += entry.elapsed
+        return BufferedResult(entry)
+
+    def runner(self, key, runner):
+        """ Wrap a function used to run a statement so that its result
+        is replayed from the cache if possible, or otherwise cached once
+        read in full.
+        """
+
+        def run(statement, parameters):
+            result = self.get(key)
+            if result is None:
+                t0 = timer()
+                result = RecordingResult(self, key, runner(statement, parameters), t0)
+            return result
+
+        return run
+
+    def put(self, key, keys, rows, summary, elapsed):
+        entry = CacheEntry(list(keys), rows,
+                           CachedSummary(getattr(summary, "statement", None), getattr(summary, "parameters", None),
+                                         summary.server.address),
+                           elapsed, time() + self.ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            self._evict()
+            if self.directory:
+                self._store(key, entry)
+
+    def bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def invalidate(self):
+        """ Discard all entries, as after a write.
+        """
+        with self._lock:
+            self.invalidations += 1
+            self._clear()
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._entries.clear()
+        if self.directory:
+            for file_name in glob(path_join(self.directory, "*.n4cache")):
+                try:
+                    remove(file_name)
+                except OSError:
+                    pass
+
+    def _evict(self):
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load(self, key, now):
+        try:
+            with open(self._file_name(key), "rb") as f:
+                stored_key, keys, rows, statement, parameters, address, elapsed, expires = marshal_load(f)
+            if stored_key != key or expires <= now:
+                return None
+            return CacheEntry(list(keys), rows, CachedSummary(statement, parameters, tuple(address)),
+                              elapsed, expires)
+        except Exception:
+            # Missing, partly written or foreign files are all just misses
+            return None
+
+    def _store(self, key, entry):
+        summary = entry.summary
+        data = (key, entry.keys, entry.rows, summary.statement, summary.parameters,
+                tuple(summary.server.address), entry.elapsed, entry.expires)
+        try:
+            with atomic_write(self._file_name(key), binary=True) as f:
+                marshal_dump(data, f)
+        except Exception:
+            # Not every value can be marshalled; such results stay in memory only
+            pass
+
+    @property
+    def size(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
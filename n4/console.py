@@ -18,61 +18,112 @@
 
 from __future__ import division, print_function
 
+from contextlib import contextmanager
 from datetime import datetime
+from glob import glob
+from io import open as io_open, StringIO, TextIOWrapper
+from json import dumps as json_dumps
+import atexit
+from threading import Lock, Thread
+import re
 import shlex
 import os
-from os.path import expanduser
-from subprocess import call
-from tempfile import NamedTemporaryFile
+import sys
+from os.path import basename, expanduser, join as path_join
 from timeit import default_timer as timer
 from textwrap import dedent
 
 import click
-from cypy.lex import CypherLexer
-from neo4j.v1 import GraphDatabase, ServiceUnavailable, CypherError, TransactionError
-from prompt_toolkit import prompt
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.layout.lexers import PygmentsLexer
-from prompt_toolkit.styles import style_from_pygments
-from pygments.styles.vim import VimStyle
-from pygments.token import Token
-
-from n4.table import Table
-from .data import TabularResultWriter, CSVResultWriter, TSVResultWriter
+from cypy.encoding import cypher_repr
+from neo4j.v1 import GraphDatabase, ServiceUnavailable, CypherError, TransactionError, READ_ACCESS, WRITE_ACCESS
+
+from n4.table import Table, TableValueSystem, is_tty
+from .data import TabularResultWriter, CSVResultWriter, TSVResultWriter, NullResultWriter, TimedResult, \
+    JSONLinesResultWriter, JSONArrayResultWriter, EntityIndex
 from .meta import title, description, quick_help, full_help
+from .csvutil import open_csv, read_batches
+from .playback import StatementReader, Checkpoint, normalise, fingerprint, may_write, is_write
+from .retry import RetryPolicy
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 
 EDITOR = os.environ.get("EDITOR", "vim")
+OPTION = re.compile(r"^\w+=\S*$")
 HISTORY_FILE = expanduser("~/.n4_history")
 
+DEFAULT_PAGE_SIZE = 50
+MIN_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 10000
+
 
 class Console(object):
 
     multi_line = False
     watcher = None
+    timing = False
+    export_file = None
+    cache = None
+    tracer = None
+    stats = None
+
+    #: Whether to send autocommit reads to readers and writes to writers.
+    routing = True
+
+    #: Whether to send runs of statements together, reading results afterwards.
+    pipeline = False
+
+    #: Whether to page results interactively.
+    pager = False
+
+    #: Fixed number of records per page, or :const:`None` to adapt.
+    page_size = None
+
+    #: Target time, in seconds, for writing each adaptively sized page.
+    page_time = 0.1
+
+    #: Maximum number of characters per line of a table cell, or 0 for no limit.
+    cell_width = 200
+
+    #: Maximum number of lines in a table cell, or 0 for no limit.
+    cell_height = 20
+
+    #: Whether to write graph entities seen before by reference alone.
+    dedup = False
+
+    #: Number of graph entities remembered per result when deduplicating.
+    dedup_size = 10000
+
+    #: Whether to keep the last result for sorting and filtering locally.
+    retain = False
+
+    #: Size in bytes past which a retained result moves to disk, or
+    #: :const:`None` for the default.
+    retain_spill_size = None
 
     tx_colour = "yellow"
     err_colour = "reset"
     meta_colour = "cyan"
     prompt_colour = "cyan"
 
-    def __init__(self, uri, auth, secure=True, verbose=False):
-        try:
-            self.driver = GraphDatabase.driver(uri, auth=auth, encrypted=secure)
-        except ServiceUnavailable as error:
-            raise ConsoleError("Could not connect to {} ({})".format(uri, error))
+    def __init__(self, uri, auth, secure=True, verbose=False, driver=None):
+        if driver is None:
+            try:
+                driver = GraphDatabase.driver(uri, auth=auth, encrypted=secure)
+            except ServiceUnavailable as error:
+                raise ConsoleError("Could not connect to {} ({})".format(uri, error))
+        self.driver = driver
         self.uri = uri
-        self.history = FileHistory(HISTORY_FILE)
-        self.prompt_args = {
-            "history": self.history,
-            "lexer": PygmentsLexer(CypherLexer),
-            "style": style_from_pygments(VimStyle, {
-                Token.Prompt: "#ansi{}".format(self.prompt_colour.replace("cyan", "teal")),
-                Token.TxCounter: "#ansi{} bold".format(self.tx_colour.replace("cyan", "teal")),
-            })
-        }
-        self.lexer = CypherLexer()
+        self.user = auth[0] if auth else None
+        self._prompt_args = None
+        self._lexer = None
         self.result_writer = TabularResultWriter()
+        self.retry_policy = RetryPolicy()
+        atexit.register(self.close_export)
+        atexit.register(self.close_session)
         if verbose:
             from .watcher import watch
             self.watcher = watch("neo4j.bolt")
@@ -93,20 +144,81 @@ class Console(object):
             "/read": self.run_read_tx,
             "/w": self.run_write_tx,
             "/write": self.run_write_tx,
+            "/p": self.run_parallel,
+            "/play": self.run_parallel,
+            "/import": self.import_csv,
+
+            "/param": self.param,
+            "/params": self.param,
+            "/unparam": self.unparam,
+
+            "/bench": self.bench,
+            "/profile": self.profile,
+            "/explain": self.explain,
+
+            "/bg": self.bg,
+            "/jobs": self.show_jobs,
+            "/wait": self.wait_jobs,
+            "/cancel": self.cancel_jobs,
 
             "/csv": self.set_csv_result_writer,
             "/table": self.set_tabular_result_writer,
             "/tsv": self.set_tsv_result_writer,
+            "/jsonl": self.set_jsonl_result_writer,
+            "/jsona": self.set_json_array_result_writer,
+            "/export": self.export,
+            "/dedup": self.set_dedup,
+
+            "/retain": self.set_retain,
+            "/sort": self.sort_buffer,
+            "/filter": self.filter_buffer,
+            "/top": self.top_buffer,
+            "/count": self.count_buffer,
 
             "/config": self.config,
             "/kernel": self.kernel,
+            "/timing": self.set_timing,
+            "/trace": self.trace,
+            "/stats": self.show_stats,
+            "/cache": self.set_cache,
+            "/routing": self.set_routing,
+            "/retry": self.set_retry_policy,
+            "/pipeline": self.set_pipeline,
+
+            "/pager": self.set_pager,
+            "/pagesize": self.set_page_size,
+            "/cellsize": self.set_cell_size,
+            "/expand": self.expand,
 
         }
+        # Commands which take a trailing Cypher statement, mapped to the
+        # number of positional arguments that precede it, or to None if
+        # the whole of the remaining text should be passed through as-is
+        self.statement_commands = {
+            "/import": 1,
+            "/param": None,
+            "/params": None,
+            "/bench": 0,
+            "/profile": 0,
+            "/explain": 0,
+            "/bg": 0,
+            "/filter": None,
+        }
+        self.parameters = {}
+        self.result_buffer = None
+        self.jobs = {}
+        self.job_counter = 0
         self.session = None
+        self.read_session = None
+        self.read_bookmark = None
+        self.bookmark = None
         self.tx = None
         self.tx_counter = 0
 
     def loop(self):
+        self.pager = is_tty() and is_tty(sys.stdin)
+        if self.stats is None:
+            self.start_stats()
         click.echo(title, err=True)
         click.echo("Connected to {}".format(self.uri).rstrip(), err=True)
         click.echo(err=True)
@@ -124,13 +236,22 @@ class Console(object):
                 return 1
 
     def run(self, source):
+        """ Run a line of source, which may be Cypher, transaction control
+        or a slash command, reporting any errors.
+
+        :returns: :const:`False` if an error occurred, :const:`True` otherwise
+        """
         source = source.strip()
         if not source:
-            return
+            return True
+        # Leading comments are kept with a statement, but never mistaken for a command
+        command = source if source == u"//" else strip_comments(source)
+        if not command:
+            return True
         try:
-            if source.startswith("/"):
+            if command.startswith("/"):
                 try:
-                    self.run_command(source)
+                    self.run_command(command)
                 except TypeError:
                     self.run_source(source)
             else:
@@ -151,11 +272,105 @@ class Console(object):
             raise
         except Exception as error:
             click.secho("{}: {}".format(error.__class__.__name__, str(error)), err=True, fg=self.err_colour)
+        else:
+            return True
+        return False
+
+    def run_script(self, f, exit_on_error=False, progress=None):
+        """ Run statements from a file or stream of Cypher source as they
+        are read, without holding the whole script in memory. Slash
+        commands may be used but, like Cypher statements, must be
+        terminated with a semicolon.
+
+        :param f: binary file object
+        :param exit_on_error: stop at the first statement that fails
+        :param progress: text file to which a JSON progress line is
+                         written after each statement
+        :returns: number of statements that failed
+        """
+        failures = 0
+        t0 = timer()
+        for line_no, (offset, statement) in enumerate(StatementReader(f), start=1):
+            if line_no > 1:
+                click.echo(u"")
+            t1 = timer()
+            ok = self.run(statement)
+            if not ok:
+                failures += 1
+            if progress is not None:
+                progress.write(json_dumps({"statement": line_no, "offset": offset, "ok": ok,
+                                           "time": round(timer() - t1, 6), "elapsed": round(timer() - t0, 6),
+                                           "failures": failures}) + u"\n")
+                progress.flush()
+            if failures and exit_on_error:
+                break
+        return failures
+
+    def get_session(self, access_mode=WRITE_ACCESS):
+        """ Session shared by all statements run from this console with
+        the given access mode, created on first use. Explicit
+        transactions always use the write session.
+
+        A new read session is started after each write, carrying the
+        bookmark of that write, so that reads always see earlier writes.
+        """
+        if access_mode == READ_ACCESS:
+            if self.read_session is not None and self.read_bookmark != self.bookmark:
+                self.close_session(READ_ACCESS)
+            if self.read_session is None:
+                self.read_bookmark = self.bookmark
+                self.read_session = self.driver.session(READ_ACCESS, bookmark=self.bookmark)
+            return self.read_session
+        if self.session is None:
+            self.session = self.driver.session(WRITE_ACCESS, bookmark=self.bookmark)
+        return self.session
+
+    def wrote(self, session=None):
+        """ Note that a session, by default the write session, has
+        written, so that later reads wait for that write to be visible.
+        The read session is replaced when next used.
+        """
+        if session is None:
+            session = self.session
+        if session is not None:
+            self.bookmark = session.last_bookmark() or self.bookmark
+
+    @contextmanager
+    def private_session(self, access_mode=WRITE_ACCESS):
+        """ Session for statements run apart from the shared sessions,
+        such as by scripts, imports and background jobs. It starts from
+        the latest bookmark and passes its own on once closed, so that
+        its statements and those run from the console see each other's
+        writes.
+        """
+        session = self.driver.session(access_mode, bookmark=self.bookmark)
+        try:
+            yield session
+        finally:
+            session.close()
+            self.wrote(session)
+
+    def close_session(self, access_mode=None):
+        """ Close the session for an access mode, or all sessions.
+        """
+        if access_mode != WRITE_ACCESS and self.read_session is not None:
+            session, self.read_session = self.read_session, None
+            try:
+                session.close()
+            except Exception:
+                pass
+        if access_mode != READ_ACCESS and self.session is not None:
+            session, self.session = self.session, None
+            self.tx = None
+            self.tx_counter = 0
+            try:
+                session.close()
+            except Exception:
+                pass
 
     def begin_transaction(self):
         if self.tx is None:
-            self.session = self.driver.session()
-            self.tx = self.session.begin_transaction()
+            self.tx = self.get_session().begin_transaction()
             self.tx_counter = 1
             click.secho(u"--- BEGIN at {} ---".format(datetime.now()),
                         err=True, fg=self.tx_colour, bold=True)
@@ -163,21 +378,20 @@ class Console(object):
             click.secho(u"Transaction already open", err=True, fg=self.err_colour)
 
     def commit_transaction(self):
-        if self.session:
+        if self.tx is not None:
             try:
                 self.session.commit_transaction()
+                self.wrote()
                 click.secho(u"--- COMMIT at {} ---".format(datetime.now()),
                             err=True, fg=self.tx_colour, bold=True)
             finally:
                 self.tx = None
                 self.tx_counter = 0
-                self.session.close()
-                self.session = None
         else:
             click.secho(u"No current transaction", err=True, fg=self.err_colour)
 
     def rollback_transaction(self):
-        if self.session:
+        if self.tx is not None:
             try:
                 self.session.rollback_transaction()
                 click.secho(u"--- ROLLBACK at {} ---".format(datetime.now()),
@@ -185,12 +399,44 @@ class Console(object):
             finally:
                 self.tx = None
                 self.tx_counter = 0
-                self.session.close()
-                self.session = None
         else:
             click.secho(u"No current transaction", err=True, fg=self.err_colour)
 
+    @property
+    def lexer(self):
+        """ Cypher lexer, loaded on first use.
+        """
+        if self._lexer is None:
+            from cypy.lex import CypherLexer
+            self._lexer = CypherLexer()
+        return self._lexer
+
+    @property
+    def prompt_args(self):
+        """ Prompt configuration, built on first use so that scripted
+        invocations never need to load the interactive machinery.
+        """
+        if self._prompt_args is None:
+            from cypy.lex import CypherLexer
+            from prompt_toolkit.history import FileHistory
+            from prompt_toolkit.layout.lexers import PygmentsLexer
+            from prompt_toolkit.styles import style_from_pygments
+            from pygments.styles.vim import VimStyle
+            from pygments.token import Token
+            self._prompt_args = {
+                "history": FileHistory(HISTORY_FILE),
+                "lexer": PygmentsLexer(CypherLexer),
+                "style": style_from_pygments(VimStyle, {
+                    Token.Prompt: "#ansi{}".format(self.prompt_colour.replace("cyan", "teal")),
+                    Token.TxCounter: "#ansi{} bold".format(self.tx_colour.replace("cyan", "teal")),
+                })
+            }
+        return self._prompt_args
+
     def read(self):
+        from prompt_toolkit import prompt
+        from pygments.token import Token
+
         if self.multi_line:
             self.multi_line = False
             return prompt(u"", multiline=True, **self.prompt_args)
@@ -208,53 +454,656 @@ class Console(object):
         return prompt(get_prompt_tokens=get_prompt_tokens, **self.prompt_args)
 
     def run_source(self, source):
-        for i, statement in enumerate(self.lexer.get_statements(source)):
+        if u";" in source:
+            statements = self.lexer.get_statements(source)
+        else:
+            # A lone statement needs no splitting, and therefore no lexer
+            statements = [source.strip()]
+        if self.pipeline:
+            statements = group_statements(statements)
+        for i, statement in enumerate(statements):
             if i > 0:
                 click.echo(u"")
-            if statement.upper() == "BEGIN":
+            if isinstance(statement, list):
+                self.run_pipeline(statement)
+            elif statement.upper() == "BEGIN":
                 self.begin_transaction()
             elif statement.upper() == "COMMIT":
                 self.commit_transaction()
             elif statement.upper() == "ROLLBACK":
                 self.rollback_transaction()
             elif self.tx is None:
-                with self.driver.session() as session:
-                    self.run_cypher(session.run, statement, {})
+                key = self.check_cache(statement)
+                access_mode = self.route(statement)
+
+                def runner(s, p):
+                    return self.get_session(access_mode).run(s, p)
+
+                if key is not None:
+                    runner = self.cache.runner(key, runner)
+                runner = self.retry_policy.runner(runner, reset=lambda: self.close_session(access_mode))
+                try:
+                    self.run_cypher(runner, statement, self.parameters,
+                                    access_mode=access_mode if self.routing else None)
+                except CypherError:
+                    raise
+                except Exception:
+                    # The connection may be broken, so start afresh next time
+                    self.close_session(access_mode)
+                    raise
+                if access_mode == WRITE_ACCESS:
+                    self.wrote()
             else:
-                self.run_cypher(self.tx.run, statement, {}, line_no=self.tx_counter)
+                self.check_cache(statement)
+                self.run_cypher(self.tx.run, statement, self.parameters, line_no=self.tx_counter)
                 self.tx_counter += 1
 
-    def run_cypher(self, runner, statement, parameters, line_no=0):
+    def route(self, statement):
+        """ Choose the access mode for an autocommit statement.
+        """
+        # The lexer is only needed, and so only loaded, for statements that could write
+        if self.routing and not (may_write(statement) and is_write(self.lexer, statement)):
+            return READ_ACCESS
+        return WRITE_ACCESS
+
+    def check_cache(self, statement):
+        """ Decide whether the result of a statement can come from the
+        result cache. Statements that may write invalidate the cache, and
+        neither they nor statements run within a transaction use it.
+
+        :returns: cache key, or :const:`None` if the cache is not to be used
+        """
+        if self.cache is None:
+            return None
+        if is_write(self.lexer, statement):
+            self.cache.invalidate()
+        elif self.tx is None:
+            return self.cache.key(normalise(self.lexer, statement), self.parameters)
+        self.cache.bypass()
+        return None
+
+    def invalidate_cache(self):
+        """ Clear the result cache, if on, after statements have been run
+        other than through :meth:`run_source` or :meth:`run_pipeline`.
+        """
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def run_pipeline(self, statements):
+        """ Run a sequence of statements with a single round trip. Every
+        statement is sent before any result is read, after which the
+        results are written out in order.
+
+        Outside of an explicit transaction, the statements are run
+        together in a transaction of their own, since autocommit
+        statements are always sent one at a time.
+        """
+        own_tx = self.tx is None
+        if own_tx:
+            access_mode = READ_ACCESS if all(self.route(s) == READ_ACCESS for s in statements) else WRITE_ACCESS
+            tx = self.get_session(access_mode).begin_transaction()
+        else:
+            access_mode = None
+            tx = self.tx
+        if self.cache is not None:
+            for statement in statements:
+                if is_write(self.lexer, statement):
+                    self.cache.invalidate()
+                self.cache.bypass()
+        try:
+            results = [tx.run(statement, self.parameters) for statement in statements]
+            tx.sync()
+            for i, (statement, result) in enumerate(zip(statements, results)):
+                if i > 0:
+                    click.echo(u"")
+                line_no = i + 1 if own_tx else self.tx_counter
+                self.run_cypher(lambda *_, **__: result, statement, self.parameters, line_no=line_no,
+                                access_mode=access_mode if self.routing else None)
+                if not own_tx:
+                    self.tx_counter += 1
+        except:
+            if own_tx:
+                tx.rollback()
+            raise
+        else:
+            if own_tx:
+                tx.commit()
+                if access_mode == WRITE_ACCESS:
+                    self.wrote()
+
+    def run_cypher(self, runner, statement, parameters, line_no=0, writer=None, file=None, access_mode=None):
+        """ Run a statement, write out its result and report its status.
+
+        :param runner: function used to run the statement
+        :param statement: Cypher statement
+        :param parameters: dictionary of parameters
+        :param line_no: position within the current transaction, if any
+        :param writer: result writer to use instead of the console default
+        :param file: file for status output instead of stderr
+        :param access_mode: access mode the statement was routed with, if
+                            this should be reported
+        :returns: number of records returned
+        """
+        if self.tracer is not None:
+            self.tracer.mark(abbreviate(statement))
+        rendered = (writer or self.result_writer).written
         t0 = timer()
-        result = runner(statement, parameters)
-        record_count = self.write_result(result)
-        status = u"{} record{} from {} in {:.3f}s".format(
+        try:
+            result = runner(statement, parameters)
+            t1 = timer()
+            if self.timing:
+                result = TimedResult(result)
+            record_count = self.write_result(result, writer=writer)
+        except Exception as error:
+            if self.stats is not None:
+                self.stats.add_error(fingerprint(self.lexer, statement), error, getattr(runner, "retries", 0))
+            raise
+        t2 = timer()
+        summary = result.summary()
+        retries = getattr(runner, "retries", 0)
+        if self.stats is not None:
+            self.stats.add(fingerprint(self.lexer, statement), t2 - t0, record_count,
+                           (writer or self.result_writer).written - rendered, retries)
+        retry_time = getattr(runner, "retry_time", 0.0)
+        status = u"{} record{} from {}{} in {:.3f}s{}".format(
             record_count,
             "" if record_count == 1 else "s",
-            address_str(result.summary().server.address),
-            timer() - t0,
+            u"cache" if getattr(summary, "cached", False) else address_str(summary.server.address),
+            u" [{}]".format(u"read" if access_mode == READ_ACCESS else u"write") if access_mode else u"",
+            t2 - t0,
+            u" after {} retr{} ({:.3f}s)".format(retries, "y" if retries == 1 else "ies", retry_time)
+            if retries else u"",
         )
         if line_no:
-            click.secho(u"(", err=True, fg=self.meta_colour, bold=True, nl=False)
-            click.secho(u"{}".format(line_no), err=True, fg=self.tx_colour, bold=True, nl=False)
-            click.secho(u")->({})".format(status), err=True, fg=self.meta_colour, bold=True)
+            # Composed up front so that concurrent status lines never interleave
+            click.echo(click.style(u"(", fg=self.meta_colour, bold=True) +
+                       click.style(u"{}".format(line_no), fg=self.tx_colour, bold=True) +
+                       click.style(u")->({})".format(status), fg=self.meta_colour, bold=True),
+                       err=True, file=file)
         else:
-            click.secho(u"({})".format(status), err=True, fg=self.meta_colour, bold=True)
+            click.secho(u"({})".format(status), err=True, file=file, fg=self.meta_colour, bold=True)
+        if self.timing:
+            self.write_timing(summary, t1 - t0 - retry_time, result.fetch_time, t2 - t1 - result.fetch_time,
+                              file=file, retry_time=retry_time)
+        return record_count
+
+    def write_timing(self, summary, run_time, fetch_time, render_time, file=None, retry_time=0.0):
+        """ Show a breakdown of where the time for a statement was spent.
+
+        Server times come from the result summary; the remainder of the
+        time spent running the statement and fetching records is
+        attributed to the network and to decoding on the client.
+        """
+        available = getattr(summary, "result_available_after", None)
+        consumed = getattr(summary, "result_consumed_after", None)
+        parts = []
+        if retry_time:
+            parts.append(u"failed attempts and waiting {:.1f}ms".format(1000 * retry_time))
+        if available is not None and consumed is not None:
+            parts.append(u"server {:.1f}ms (planning and execution {}ms, streaming {}ms)".format(
+                available + consumed, available, consumed))
+            network = run_time + fetch_time - (available + consumed) / 1000
+            parts.append(u"network and decoding {:.1f}ms".format(1000 * max(network, 0.0)))
+        else:
+            parts.append(u"run {:.1f}ms".format(1000 * run_time))
+            parts.append(u"fetch and decoding {:.1f}ms".format(1000 * fetch_time))
+        parts.append(u"rendering {:.1f}ms".format(1000 * render_time))
+        click.secho(u"(timing: {})".format(u", ".join(parts)), err=True, file=file, fg=self.meta_colour)
+
+    def trace(self, *args, **kwargs):
+        """ Control the protocol trace recorder. With no arguments, show
+        a summary of the protocol activity for each statement traced.
+        """
+        action = args[0].lower() if args else u"summary"
+        if action == u"dump":
+            if self.tracer is None:
+                click.secho(u"Trace is off", err=True, fg=self.meta_colour)
+            elif len(args) < 2 or args[1] == u"-":
+                self.dump_trace(click.get_text_stream("stdout"))
+            else:
+                with io_open(expanduser(args[1]), "w", encoding="utf-8") as f:
+                    self.dump_trace(f)
+                click.secho(u"Trace written to {}".format(args[1]), err=True, fg=self.meta_colour)
+        elif action == u"clear":
+            if self.tracer is not None:
+                self.tracer.clear()
+        elif action == u"summary":
+            self.show_trace_summary()
+        elif parse_bool(action):
+            self.start_trace(kwargs.get("size"))
+            click.secho(u"Trace is on (last {} events kept)".format(self.tracer.capacity),
+                        err=True, fg=self.meta_colour)
+        else:
+            self.stop_trace()
+            click.secho(u"Trace is off", err=True, fg=self.meta_colour)
+
+    def start_trace(self, capacity=None):
+        from .watcher import TraceRecorder
+        self.stop_trace()
+        self.tracer = TraceRecorder(capacity=capacity)
+        self.tracer.start()
+
+    def stop_trace(self):
+        if self.tracer is not None:
+            self.tracer.stop()
+            self.tracer = None
+
+    def dump_trace(self, f):
+        f.write(u"".join(line + u"\n" for line in self.tracer.lines()))
+        f.flush()
+
+    def show_trace_summary(self):
+        if self.tracer is None:
+            click.secho(u"Trace is off", err=True, fg=self.meta_colour)
+            return
+        table = Table(["statement", "time", "round trips", "sent", "received", "records", "approx. size"])
+        traces = self.tracer.summary()
+        for trace in traces:
+            table.append((trace.label or u"(other)", 1000 * trace.elapsed, trace.round_trips,
+                          trace.sent, trace.received, trace.records, trace.size))
+        table.echo(header_style={"fg": self.meta_colour, "bold": True})
+        click.secho(u"({} event{} recorded, times in ms, sizes in characters as logged)".format(
+            len(self.tracer.events), "" if len(self.tracer.events) == 1 else "s"),
+            err=True, fg=self.meta_colour, bold=True)
+
+    def start_cache(self, capacity=None, ttl=None, max_rows=None, directory=None):
+        from .cache import ResultCache
+        # Results are only shared with processes using the same server as the same user
+        self.cache = ResultCache(capacity=capacity, ttl=ttl, max_rows=max_rows, directory=directory,
+                                 scope=u"{} {}".format(self.uri, self.user or u""))
+
+    def start_stats(self):
+        from .stats import SessionStats
+        self.stats = SessionStats()
+
+    def show_stats(self, *args, **kwargs):
+        """ Show session statistics, or switch them on, off, reset them
+        or export them to a file.
+        """
+        action = args[0].lower() if args else u"show"
+        if action == u"export":
+            if self.stats is None or len(args) < 2:
+                click.secho(u"Usage: /stats export FILE [format=json|prometheus] (with stats on)",
+                            err=True, fg=self.err_colour)
+                return
+            self.stats.export(expanduser(args[1]), kwargs.get("format"))
+            click.secho(u"Statistics written to {}".format(args[1]), err=True, fg=self.meta_colour)
+        elif action == u"reset":
+            if self.stats is not None:
+                self.start_stats()
+        elif action != u"show":
+            if parse_bool(action):
+                if self.stats is None:
+                    self.start_stats()
+            else:
+                self.stats = None
+            click.secho(u"Statistics are {}".format("on" if self.stats else "off"), err=True, fg=self.meta_colour)
+        elif self.stats is None:
+            click.secho(u"Statistics are off", err=True, fg=self.meta_colour)
+        else:
+            stats = self.stats
+            table = Table(["statement", "count", "errors", "records", "total", "mean", "p50", "p90", "p99", "max"])
+            for item in stats.ranked():
+                latency = item.latency
+                table.append((abbreviate(item.fingerprint), latency.count, item.errors, item.records,
+                              latency.sum, 1000 * latency.mean, 1000 * latency.percentile(50),
+                              1000 * latency.percentile(90), 1000 * latency.percentile(99), 1000 * latency.max))
+            table.echo(header_style={"fg": self.meta_colour, "bold": True})
+            for name, count in sorted(stats.errors.items()):
+                click.secho(u"{} x {}".format(count, name), err=True, fg=self.err_colour)
+            click.secho(u"({} statement{} with {} error{} and {} retr{}, {} record{}, {} characters written "
+                        u"in {:.3f}s; totals in s, latencies in ms, percentiles are bucket upper bounds)".format(
+                            stats.statements, "" if stats.statements == 1 else "s",
+                            stats.error_count, "" if stats.error_count == 1 else "s",
+                            stats.retries, "y" if stats.retries == 1 else "ies",
+                            stats.records, "" if stats.records == 1 else "s",
+                            stats.rendered, stats.uptime),
+                        err=True, fg=self.meta_colour, bold=True)
 
-    def write_result(self, result, page_size=50):
+    def set_timing(self, *args, **kwargs):
+        if args:
+            self.timing = parse_bool(args[0])
+        click.secho(u"Timing is {}".format("on" if self.timing else "off"), err=True, fg=self.meta_colour)
+
+    def write_result(self, result, page_size=None, writer=None):
+        """ Write out a result in pages.
+
+        When paging interactively, each page fills the terminal and the
+        user is asked before the next one is fetched. Otherwise, unless a
+        fixed page size is set, the page size adapts so that each page
+        takes roughly :attr:`page_time` seconds to fetch and write.
+
+        :returns: number of records written
+        """
+        writer = writer or self.result_writer
+        if isinstance(writer, TabularResultWriter):
+            writer.max_width, writer.max_height = self.cell_width, self.cell_height
+        writer.entities = EntityIndex(self.dedup_size) if self.dedup else None
+        if self.retain and writer is self.result_writer and result.keys():
+            from .buffer import ResultBuffer, RetainedResult
+            if not isinstance(result, RetainedResult):
+                if self.result_buffer is not None:
+                    self.result_buffer.close()
+                self.result_buffer = ResultBuffer(result.keys(), self.retain_spill_size)
+                result = self.result_buffer.retain(result)
+        page_size = page_size or self.page_size
+        interactive = self.pager and writer is self.result_writer and writer.styled and is_tty(sys.stdin)
+        adaptive = not page_size and not interactive
+        if interactive:
+            # Leave room for the header, the trailing blank line and the pager prompt
+            page_size = max(terminal_height() - 5, 1)
+        elif adaptive:
+            page_size = DEFAULT_PAGE_SIZE
         record_count = 0
         if result.keys():
-            self.result_writer.write_header(result)
+            writer.write_header(result)
             more = True
             while more:
-                record_count += self.result_writer.write(result, page_size)
+                t0 = timer()
+                count = writer.write(result, page_size)
+                record_count += count
                 more = result.peek() is not None
+                if more and interactive and not self.more(record_count):
+                    writer.flush()
+                    discard(result, self.lexer)
+                    break
+                elif adaptive and count:
+                    rate = count / max(timer() - t0, 1e-6)
+                    page_size = min(max(int(rate * self.page_time), MIN_PAGE_SIZE), MAX_PAGE_SIZE)
+            writer.flush()
+            if writer is self.result_writer and getattr(writer, "shortened_count", 0):
+                click.secho(u"({} cell{} shortened; use /expand RECORD COLUMN to show one from the last page)".format(
+                    writer.shortened_count, "" if writer.shortened_count == 1 else "s"),
+                    err=True, fg=self.meta_colour)
         return record_count
 
+    def more(self, record_count):
+        """ Prompt the user to continue paging.
+
+        :returns: :const:`True` to show the next page, :const:`False` to stop
+        """
+        message = u"-- {} record{} so far: [Space] or [Enter] for more, [Q] to stop --".format(
+            record_count, "" if record_count == 1 else "s")
+        click.secho(message, err=True, nl=False, fg=self.meta_colour)
+        try:
+            key = click.getchar()
+        except (KeyboardInterrupt, EOFError):
+            key = u"q"
+        click.echo(u"\r" + u" " * len(message) + u"\r", err=True, nl=False)
+        return key.lower() not in (u"q", u"\x03", u"\x1b")
+
+    def set_pipeline(self, *args, **kwargs):
+        if args:
+            self.pipeline = parse_bool(args[0])
+        click.secho(u"Pipelining is {}".format("on" if self.pipeline else "off"), err=True, fg=self.meta_colour)
+
+    def set_routing(self, *args, **kwargs):
+        if args:
+            self.routing = parse_bool(args[0])
+        click.secho(u"Routing is {}".format("on" if self.routing else "off"), err=True, fg=self.meta_colour)
+
+    def set_retry_policy(self, *args, **kwargs):
+        """ Show or change the retry policy, e.g. `/retry 5 delay=0.2`.
+        Retrying can be switched off with `/retry off`.
+        """
+        if args:
+            kwargs["retries"] = 0 if args[0] in ("off", "no") else args[0]
+        if kwargs:
+            settings = dict((name, getattr(self.retry_policy, name))
+                            for name in ("retries", "delay", "factor", "jitter", "budget"))
+            settings.update((name, value) for name, value in kwargs.items() if name in settings)
+            self.retry_policy = RetryPolicy(**settings)
+        click.secho(u"Retry policy: {}".format(self.retry_policy), err=True, fg=self.meta_colour)
+
+    def set_cache(self, *args, **kwargs):
+        """ Switch the result cache on or off, clear it or show its
+        statistics.
+        """
+        action = args[0].lower() if args else u"stats"
+        if action == u"clear":
+            if self.cache is not None:
+                self.cache.clear()
+            click.secho(u"Cache cleared", err=True, fg=self.meta_colour)
+        elif action == u"stats":
+            if self.cache is None:
+                click.secho(u"Cache is off", err=True, fg=self.meta_colour)
+                return
+            cache = self.cache
+            table = Table(["entries", "hits", "disk hits", "misses", "hit rate", "bypassed",
+                           "invalidated", "evicted", "time saved"])
+            table.append((cache.size, cache.hits, cache.disk_hits, cache.misses,
+                          u"{:.1f}%".format(100 * cache.hit_rate), cache.bypasses,
+                          cache.invalidations, cache.evictions, cache.saved_time))
+            table.echo(header_style={"fg": self.meta_colour, "bold": True})
+        else:
+            if parse_bool(action):
+                self.start_cache(capacity=kwargs.get("size"), ttl=kwargs.get("ttl"),
+                                 max_rows=kwargs.get("rows"), directory=kwargs.get("dir"))
+                click.secho(u"Cache is on ({} entries for {}s{})".format(
+                    self.cache.capacity, self.cache.ttl,
+                    u" in " + self.cache.directory if self.cache.directory else u""),
+                    err=True, fg=self.meta_colour)
+            else:
+                self.cache = None
+                click.secho(u"Cache is off", err=True, fg=self.meta_colour)
+
+    def set_pager(self, *args, **kwargs):
+        if args:
+            self.pager = parse_bool(args[0])
+        click.secho(u"Pager is {}".format("on" if self.pager else "off"), err=True, fg=self.meta_colour)
+
+    def set_page_size(self, *args, **kwargs):
+        if args:
+            self.page_size = None if args[0] == "auto" else int(args[0])
+        click.secho(u"Page size is {}".format(self.page_size or "auto"), err=True, fg=self.meta_colour)
+
+    def set_retain(self, *args, **kwargs):
+        """ Switch retention of the last result on or off, e.g.
+        `/retain on spill=1000000`.
+        """
+        if args:
+            self.retain = parse_bool(args[0])
+            if not self.retain and self.result_buffer is not None:
+                self.result_buffer.close()
+                self.result_buffer = None
+        if "spill" in kwargs:
+            self.retain_spill_size = int(kwargs["spill"])
+        if not self.retain:
+            click.secho(u"Retention is off", err=True, fg=self.meta_colour)
+            return
+        buffer = self.result_buffer
+        click.secho(u"Retention is on{}".format(
+            u" (last result: {} record{}, {} bytes {})".format(
+                buffer.record_count, "" if buffer.record_count == 1 else "s", buffer.size,
+                u"on disk" if buffer.spilled else u"in memory") if buffer else u""),
+            err=True, fg=self.meta_colour)
+
+    def get_buffer(self):
+        if self.result_buffer is None:
+            click.secho(u"No result retained (use /retain on)", err=True, fg=self.err_colour)
+        return self.result_buffer
+
+    def write_buffer(self, result, t0):
+        record_count = self.write_result(result)
+        click.secho(u"({} record{} from {}retained result in {:.3f}s)".format(
+            record_count, "" if record_count == 1 else "s",
+            u"" if self.result_buffer.complete else u"partly ", timer() - t0),
+            err=True, fg=self.meta_colour, bold=True)
+
+    def sort_buffer(self, *args, **kwargs):
+        """ Sort the retained result by one or more columns, each given
+        by name or number and prefixed with `-` for descending order.
+        """
+        buffer = self.get_buffer()
+        if buffer is None:
+            return
+        if not args:
+            click.secho(u"Usage: /sort [-]COLUMN...", err=True, fg=self.err_colour)
+            return
+        try:
+            columns = [(buffer.column_index(arg[1:] if arg.startswith(u"-") else arg), arg.startswith(u"-"))
+                       for arg in args]
+        except ValueError as error:
+            click.secho(error.args[0], err=True, fg=self.err_colour)
+            return
+        t0 = timer()
+        buffer.sort(columns)
+        self.write_buffer(buffer.result(), t0)
+
+    def filter_buffer(self, expression=u""):
+        """ Narrow the retained result to the records for which an
+        expression holds, with columns available as variables, or show
+        every record again if no expression is given. Expressions are
+        limited to comparisons and arithmetic, as checked by
+        :func:`.compile_filter`, and run without builtins.
+        """
+        buffer = self.get_buffer()
+        if buffer is None:
+            return
+        t0 = timer()
+        if not expression:
+            buffer.reset()
+            self.write_buffer(buffer.result(), t0)
+            return
+        from .buffer import compile_filter
+        try:
+            code = compile_filter(expression)
+        except SyntaxError as error:
+            click.secho(u"Invalid filter: {}".format(error.msg), err=True, fg=self.err_colour)
+            return
+        except ValueError as error:
+            click.secho(u"Invalid filter: {}".format(error.args[0]), err=True, fg=self.err_colour)
+            return
+        namespace = {"__builtins__": {}, "True": True, "False": False, "None": None}
+
+        def predicate(row):
+            try:
+                return eval(code, namespace, row)
+            except (TypeError, AttributeError, ArithmeticError, LookupError, ValueError):
+                # Such as a comparison with null, division by zero or a missing key,
+                # none of which is ever true
+                return False
+
+        try:
+            buffer.filter(predicate)
+        except Exception as error:
+            click.secho(u"Filter failed: {}".format(error_str(error)), err=True, fg=self.err_colour)
+            return
+        self.write_buffer(buffer.result(), t0)
+
+    def top_buffer(self, *args, **kwargs):
+        """ Show the records of the retained result with the greatest
+        values in a column.
+        """
+        buffer = self.get_buffer()
+        if buffer is None:
+            return
+        try:
+            n, column = int(args[0]), buffer.column_index(args[1])
+        except IndexError:
+            click.secho(u"Usage: /top N COLUMN", err=True, fg=self.err_colour)
+            return
+        except ValueError as error:
+            click.secho(error.args[0], err=True, fg=self.err_colour)
+            return
+        t0 = timer()
+        self.write_buffer(buffer.result(buffer.top(n, column)), t0)
+
+    def count_buffer(self, *args, **kwargs):
+        """ Count the records of the retained result, in total or for
+        each distinct value in a column.
+        """
+        buffer = self.get_buffer()
+        if buffer is None:
+            return
+        if not args:
+            click.secho(u"{} record{}".format(len(buffer), "" if len(buffer) == 1 else "s"),
+                        err=True, fg=self.meta_colour)
+            return
+        try:
+            column = buffer.column_index(args[0])
+        except ValueError as error:
+            click.secho(error.args[0], err=True, fg=self.err_colour)
+            return
+        table = Table([buffer.keys[column], u"count"])
+        for value, count in buffer.count(column):
+            table.append((value, count))
+        table.echo(header_style={"fg": self.meta_colour, "bold": True})
+
+    def set_cell_size(self, *args, **kwargs):
+        """ Set the maximum width and height of table cells, e.g.
+        `/cellsize 80 5`, or remove the limits with `/cellsize off`.
+        """
+        if args:
+            if args[0] in ("off", "no"):
+                self.cell_width = self.cell_height = 0
+            else:
+                self.cell_width = int(args[0])
+                if len(args) > 1:
+                    self.cell_height = int(args[1])
+        click.secho(u"Table cells show up to {} characters per line and {} lines".format(
+            self.cell_width or u"any number of", self.cell_height or u"any number of"), err=True, fg=self.meta_colour)
+
+    def set_dedup(self, *args, **kwargs):
+        """ Switch deduplication of graph entities on or off, e.g.
+        `/dedup on size=50000`.
+        """
+        if args:
+            self.dedup = parse_bool(args[0])
+        if "size" in kwargs:
+            self.dedup_size = int(kwargs["size"])
+        if self.dedup:
+            click.secho(u"Deduplication is on (up to {} entities per result)".format(self.dedup_size),
+                        err=True, fg=self.meta_colour)
+        else:
+            click.secho(u"Deduplication is off", err=True, fg=self.meta_colour)
+
+    def expand(self, *args, **kwargs):
+        """ Show the full value of a table cell that was shortened on the
+        last page of output. The record is numbered from 1 within its
+        result, and the column is given by name or by number from 1.
+        """
+        writer = self.result_writer
+        shortened = getattr(writer, "shortened", None)
+        if len(args) != 2:
+            click.secho(u"Usage: /expand RECORD COLUMN", err=True, fg=self.err_colour)
+            return
+        if not shortened:
+            click.secho(u"No shortened cells to expand", err=True, fg=self.err_colour)
+            return
+        record, column = args
+        if column in writer.keys:
+            column = writer.keys.index(column)
+        else:
+            try:
+                column = int(column) - 1
+            except ValueError:
+                click.secho(u"Unknown column: {}".format(column), err=True, fg=self.err_colour)
+                return
+        try:
+            value = shortened[int(record), column]
+        except (KeyError, ValueError):
+            click.secho(u"Cell {} {} was not shortened on the last page".format(*args), err=True, fg=self.err_colour)
+        else:
+            click.echo(TableValueSystem().encode(value))
+
     def run_command(self, source):
         source = source.lstrip()
         assert source
-        terms = shlex.split(source)
+        command_name = source.split(None, 1)[0]
+        if command_name in self.statement_commands:
+            # Trailing Cypher is passed through verbatim as the final argument
+            arg_count = self.statement_commands[command_name]
+            if arg_count is None:
+                self.commands[command_name](source[len(command_name):].strip())
+            else:
+                args, kwargs, statement = split_statement_command(source, arg_count)
+                self.commands[command_name](*(args + [statement]), **kwargs)
+            return
+        try:
+            terms = shlex.split(source)
+        except ValueError as error:
+            raise ConsoleError("Cannot parse command ({})".format(error))
         command_name = terms[0]
         try:
             command = self.commands[command_name]
@@ -278,6 +1127,8 @@ class Console(object):
 
     def edit(self, **kwargs):
         initial_message = b""
+        from subprocess import call
+        from tempfile import NamedTemporaryFile
         with NamedTemporaryFile(suffix=".cypher") as f:
             f.write(initial_message)
             f.flush()
@@ -297,42 +1148,558 @@ class Console(object):
     def exit(cls, **kwargs):
         exit(0)
 
-    def load_unit_of_work(self, file_name):
+    def load_unit_of_work(self, file_name, writer=None, file=None):
         """ Load a transaction function from a cypher source file.
+        The file is read incrementally as its statements are run.
+
+        The transaction function returns a pair of (statement count,
+        record count). Output can be redirected with `writer` and `file`,
+        as for :meth:`.run_cypher`.
         """
-        with open(expanduser(file_name)) as f:
-            source = f.read()
 
         def unit_of_work(tx):
-            for line_no, statement in enumerate(self.lexer.get_statements(source), start=1):
-                if line_no > 0:
-                    click.echo(u"")
-                self.run_cypher(tx.run, statement, {}, line_no=line_no)
+            parameters = dict(self.parameters)
+            statement_count = record_count = 0
+            with open(expanduser(file_name), "rb") as f:
+                for _, statement in StatementReader(f):
+                    if is_parameter_declaration(statement):
+                        self.declare_parameter(tx.run, statement, parameters)
+                        continue
+                    # Only Cypher statements are numbered, as for /play
+                    statement_count += 1
+                    click.echo(u"", file=file)
+                    record_count += self.run_cypher(tx.run, statement, parameters, line_no=statement_count,
+                                                    writer=writer, file=file)
+            return statement_count, record_count
 
         return unit_of_work
 
+    def play(self, file_name, access_mode, batch=None, every=None, resume=False):
+        """ Run a cypher source file as a series of transactions, each
+        committed after `batch` statements or `every` seconds.
+
+        A checkpoint is recorded after each commit and removed once the
+        whole file has been run. If `resume` is set, playback restarts
+        from the last checkpoint instead of the start of the file.
+        """
+        checkpoint = Checkpoint(file_name)
+        offset, line_no, declarations = checkpoint.load() if resume else (0, 0, [])
+        if offset:
+            click.secho(u"--- RESUME from statement {} ---".format(line_no + 1),
+                        err=True, fg=self.tx_colour, bold=True)
+        parameters = dict(self.parameters)
+        retries = chunk_retries = 0
+        retry_time = 0.0
+        with open(expanduser(file_name), "rb") as f, self.private_session(access_mode) as session:
+            for declaration in declarations:
+                self.declare_parameter(session.run, declaration, parameters)
+            tx = None
+            t0 = count = 0
+            started = None
+            while True:
+                # Each pass starts from the last commit, so a failed chunk can be run again
+                attempt_started = timer()
+                if started is None:
+                    started = attempt_started
+                restart = (offset, line_no, list(declarations), dict(parameters))
+                f.seek(offset)
+                try:
+                    for offset, statement in StatementReader(f, offset):
+                        if is_parameter_declaration(statement):
+                            self.declare_parameter(tx.run if tx else session.run, statement, parameters)
+                            declarations.append(statement)
+                            continue
+                        if tx is None:
+                            tx = session.begin_transaction()
+                            t0 = timer()
+                            count = 0
+                        line_no += 1
+                        count += 1
+                        click.echo(u"")
+                        self.run_cypher(tx.run, statement, parameters, line_no=line_no)
+                        if (batch and count >= batch) or (every and timer() - t0 >= every):
+                            tx.commit()
+                            tx = None
+                            checkpoint.save(offset, line_no, declarations)
+                            restart = (offset, line_no, list(declarations), dict(parameters))
+                            started = attempt_started = timer()
+                            chunk_retries = 0
+                            click.secho(u"--- COMMIT at {} after statement {} ---".format(datetime.now(), line_no),
+                                        err=True, fg=self.tx_colour, bold=True)
+                    if tx is not None:
+                        tx.commit()
+                        tx = None
+                        click.secho(u"--- COMMIT at {} after statement {} ---".format(datetime.now(), line_no),
+                                    err=True, fg=self.tx_colour, bold=True)
+                except Exception as error:
+                    if tx is not None:
+                        try:
+                            tx.rollback()
+                        except Exception:
+                            pass
+                        tx = None
+                        click.secho(u"--- ROLLBACK at {} to statement {} ---".format(datetime.now(), line_no - count),
+                                    err=True, fg=self.tx_colour, bold=True)
+                    if not self.retry_policy.wait(error, chunk_retries, started):
+                        raise
+                    retries += 1
+                    chunk_retries += 1
+                    retry_time += timer() - attempt_started
+                    offset, line_no, declarations, parameters = restart
+                    click.secho(u"--- RETRY {} at {} from statement {} after {} ---".format(
+                        chunk_retries, datetime.now(), line_no + 1, error_str(error)),
+                        err=True, fg=self.tx_colour, bold=True)
+                else:
+                    break
+        if retries:
+            click.secho(u"({} retr{} in {:.3f}s)".format(retries, "y" if retries == 1 else "ies", retry_time),
+                        err=True, fg=self.meta_colour, bold=True)
+        checkpoint.clear()
+
     def run_read_tx(self, *args, **kwargs):
-        if args:
-            with self.driver.session() as session:
-                session.read_transaction(self.load_unit_of_work(args[0]))
-        else:
-            click.secho("Usage: /r FILE", err=True, fg=self.err_colour)
+        self.run_tx(READ_ACCESS, "/r", *args, **kwargs)
 
     def run_write_tx(self, *args, **kwargs):
-        if args:
-            with self.driver.session() as session:
-                session.write_transaction(self.load_unit_of_work(args[0]))
+        self.run_tx(WRITE_ACCESS, "/w", *args, **kwargs)
+
+    def run_tx(self, access_mode, command_name, *args, **kwargs):
+        if not args:
+            click.secho("Usage: {} FILE [batch=N] [every=SECONDS] [resume=yes]".format(command_name),
+                        err=True, fg=self.err_colour)
+            return
+        batch = int(kwargs.get("batch", 0))
+        every = float(kwargs.get("every", 0))
+        resume = parse_bool(kwargs.get("resume", "no"))
+        try:
+            if batch or every or resume:
+                self.play(args[0], access_mode, batch=batch, every=every, resume=resume)
+            else:
+                with self.private_session(access_mode) as session:
+                    _, retries, retry_time = self.run_unit_of_work(session, self.load_unit_of_work(args[0]))
+                if retries:
+                    click.secho(u"({} retr{} in {:.3f}s)".format(retries, "y" if retries == 1 else "ies", retry_time),
+                                err=True, fg=self.meta_colour, bold=True)
+        finally:
+            self.invalidate_cache()
+
+    def run_unit_of_work(self, session, unit_of_work, file=None):
+        """ Run a transaction function in a transaction of its own,
+        trying again after a transient failure as the retry policy allows.
+
+        :returns: triple of (value returned, number of retries, seconds
+                  spent on failed attempts and waiting)
+        """
+        retries = 0
+        t0 = timer()
+        while True:
+            t1 = timer()
+            tx = session.begin_transaction()
+            try:
+                value = unit_of_work(tx)
+                tx.commit()
+            except Exception as error:
+                try:
+                    tx.rollback()
+                except Exception:
+                    pass
+                if not self.retry_policy.wait(error, retries, t0):
+                    raise
+                retries += 1
+                click.secho(u"--- RETRY {} at {} after {} ---".format(retries, datetime.now(), error_str(error)),
+                            err=True, file=file, fg=self.tx_colour, bold=True)
+            else:
+                return value, retries, t1 - t0
+
+    def run_parallel(self, *args, **kwargs):
+        if not args:
+            click.secho("Usage: /p FILE_OR_PATTERN... [mode=r|w] [workers=N] [logs=DIR]",
+                        err=True, fg=self.err_colour)
+            return
+        access_mode = READ_ACCESS if kwargs.get("mode", "w").lower().startswith("r") else WRITE_ACCESS
+        self.play_parallel(args, access_mode, workers=int(kwargs.get("workers", 4)), logs=kwargs.get("logs"))
+
+    def play_parallel(self, patterns, access_mode, workers=4, logs=None):
+        """ Run a set of independent cypher source files concurrently,
+        each in its own session and transaction.
+
+        Result output for each file is written to a log file within the
+        `logs` directory, if given, or is otherwise discarded. A summary
+        is shown once all files have been run.
+
+        :returns: number of files that failed
+        """
+        file_names = []
+        for pattern in patterns:
+            matches = sorted(glob(expanduser(pattern))) or [pattern]
+            file_names.extend(name for name in matches if name not in file_names)
+
+        def play(file_name):
+            log = writer = None
+            statement_count = record_count = retries = 0
+            error = None
+            t0 = timer()
+            try:
+                if logs:
+                    log = io_open(path_join(expanduser(logs), basename(file_name) + ".log"), "w", encoding="utf-8")
+                else:
+                    log = io_open(os.devnull, "w", encoding="utf-8")
+                writer = self.result_writer.__class__(file=log) if logs else NullResultWriter()
+                with self.private_session(access_mode) as session:
+                    (statement_count, record_count), retries, _ = self.run_unit_of_work(
+                        session, self.load_unit_of_work(file_name, writer, log), file=log)
+            except CypherError as e:
+                error = u"{}: {}".format(e.title, e.message)
+            except Exception as e:
+                error = u"{}: {}".format(e.__class__.__name__, e)
+            finally:
+                if writer is not None:
+                    writer.flush()
+                if log is not None:
+                    log.close()
+            return file_name, statement_count, record_count, retries, timer() - t0, error
+
+        from multiprocessing.pool import ThreadPool
+        workers = max(1, min(workers, len(file_names)))
+        pool = ThreadPool(workers)
+        table = Table(["file", "statements", "records", "retries", "time", "status"])
+        failures = 0
+        t0 = timer()
+        try:
+            for outcome in pool.imap_unordered(play, file_names):
+                file_name, statement_count, record_count, retries, elapsed, error = outcome
+                if error:
+                    failures += 1
+                    click.secho(u"{}: {}".format(file_name, error), err=True, fg=self.err_colour)
+                table.append((file_name, statement_count, record_count, retries, elapsed, error or u"ok"))
+        finally:
+            pool.close()
+            pool.join()
+            self.invalidate_cache()
+        table.echo(header_style={"fg": self.meta_colour, "bold": True})
+        click.secho(u"({} file{} ({} failed) using {} worker{} in {:.3f}s)".format(
+            len(file_names), "" if len(file_names) == 1 else "s", failures,
+            workers, "" if workers == 1 else "s", timer() - t0), err=True, fg=self.meta_colour, bold=True)
+        return failures
+
+    def param(self, text=u""):
+        if not text:
+            table = Table(["name", "value"], field_separator=u" = ", padding=0, auto_align=False, header=0)
+            for name, value in sorted(self.parameters.items()):
+                table.append((u"$" + name, cypher_repr(value)))
+            table.echo(header_style={"fg": self.meta_colour})
+            return
+        with self.driver.session() as session:
+            name, value = self.declare_parameter(session.run, text, self.parameters)
+        click.secho(u"${} = {}".format(name, cypher_repr(value)), err=True, fg=self.meta_colour, bold=True)
+
+    def unparam(self, *args, **kwargs):
+        if not args:
+            click.secho("Usage: /unparam NAME...", err=True, fg=self.err_colour)
+        for name in args:
+            self.parameters.pop(name.lstrip("$"), None)
+
+    def declare_parameter(self, runner, text, parameters):
+        """ Set a parameter from a declaration of the form `name=value`,
+        optionally preceded by `/param`. The value may be any Cypher
+        expression, which is evaluated by the server and may refer to
+        parameters set previously.
+
+        :param runner: function used to evaluate the value
+        :param text: parameter declaration
+        :param parameters: dictionary of parameters to update
+        :returns: pair of (name, value)
+        """
+        if is_parameter_declaration(text):
+            text = text.split(None, 1)[1] if len(text.split(None, 1)) > 1 else u""
+        name, eq, expression = text.partition(u"=")
+        name = name.strip().lstrip(u"$").strip(u"`")
+        expression = expression.lstrip(u">").strip()
+        if not eq or not name or not expression:
+            raise ValueError("Parameter declarations must be of the form name=value")
+        value = runner(u"RETURN " + expression + u" AS value", parameters).single()["value"]
+        parameters[name] = value
+        return name, value
+
+    def profile(self, statement=u"", top=u"3", **kwargs):
+        self.show_plan(u"PROFILE", statement, int(top))
+
+    def explain(self, statement=u"", **kwargs):
+        self.show_plan(u"EXPLAIN", statement)
+
+    def show_plan(self, mode, statement, hotspots=3):
+        """ Run a statement with PROFILE or EXPLAIN and render the
+        execution plan from its summary.
+        """
+        if not statement:
+            click.secho("Usage: /{} STATEMENT".format(mode.lower()), err=True, fg=self.err_colour)
+            return
+        from .plan import plan_table
+        if statement.split(None, 1)[0].upper() not in (u"PROFILE", u"EXPLAIN"):
+            statement = mode + u" " + statement
+        with self.driver.session() as session:
+            result = session.run(statement, self.parameters)
+            self.write_result(result)
+            summary = result.summary()
+        plan = getattr(summary, "profile", None) or getattr(summary, "plan", None)
+        if plan is None:
+            click.secho(u"No plan returned", err=True, fg=self.err_colour)
+            return
+        table, hot = plan_table(plan, hotspots, hot_style={"fg": self.tx_colour, "bold": True})
+        table.echo(header_style={"fg": self.meta_colour, "bold": True})
+        for rank, (operator_type, db_hits, share) in enumerate(hot, start=1):
+            click.secho(u"#{} {} with {} db hit{} ({:.1f}% of total)".format(
+                rank, operator_type, db_hits, "" if db_hits == 1 else "s", 100 * share),
+                err=True, fg=self.tx_colour, bold=True)
+
+    def bench(self, statement=u"", n=None, time=None, c=u"1", warmup=u"0", file=None, **kwargs):
+        if file:
+            with open(expanduser(file), "rb") as f:
+                statements = [s for _, s in StatementReader(f)]
+        else:
+            statements = list(self.lexer.get_statements(statement))
+        if not statements:
+            click.secho("Usage: /bench [n=N] [time=SECONDS] [c=SESSIONS] [warmup=N] [file=FILE] [STATEMENT]",
+                        err=True, fg=self.err_colour)
+            return
+        from .bench import Benchmark
+        duration = float(time) if time else None
+        count = int(n) if n else (None if duration else 100)
+        benchmark = Benchmark(self.driver, statements, self.parameters, concurrency=int(c))
+        if int(warmup):
+            benchmark.run(count=int(warmup))
+        report = benchmark.run(count=count, duration=duration)
+        table = Table(["iterations", "errors", "time", "per sec", "mean", "p50", "p90", "p99", "max"])
+        table.append((report.count, report.error_count, report.elapsed, report.throughput,
+                      1000 * report.mean, 1000 * report.percentile(50), 1000 * report.percentile(90),
+                      1000 * report.percentile(99), 1000 * report.percentile(100)))
+        table.echo(header_style={"fg": self.meta_colour, "bold": True})
+        for name, (error_count, message) in sorted(report.errors.items()):
+            click.secho(u"{} x {}: {}".format(error_count, name, message), err=True, fg=self.err_colour)
+        click.secho(u"({} statement{} per iteration from {} session{}, latencies in ms)".format(
+            len(statements), "" if len(statements) == 1 else "s",
+            report.concurrency, "" if report.concurrency == 1 else "s"),
+            err=True, fg=self.meta_colour, bold=True)
+
+    def bg(self, statement=u"", file=None, **kwargs):
+        """ Start running a statement in the background, capturing its
+        output to `file`, or to memory until it is waited for.
+        """
+        if not statement:
+            click.secho("Usage: /bg [file=FILE] STATEMENT", err=True, fg=self.err_colour)
+            return
+        from .jobs import Job, JobCancelled
+        if file:
+            output = io_open(expanduser(file), "w", encoding="utf-8")
         else:
-            click.secho("Usage: /w FILE", err=True, fg=self.err_colour)
+            output = StringIO()
+        self.job_counter += 1
+        job = Job(self.job_counter, statement, output, file)
+        parameters = dict(self.parameters)
+        writer = self.result_writer.__class__(file=output)
+
+        def work():
+            results = []
+
+            def run(s, p):
+                # The marker lets /cancel find the query on the server
+                results.append(job.records(session.run(job.marker + u" " + s, p)))
+                return results[-1]
+
+            try:
+                with self.private_session() as session:
+                    try:
+                        self.run_cypher(run, statement, parameters, writer=writer, file=output)
+                    except JobCancelled:
+                        # Closing the session as it stands would fetch the rest of the result
+                        for result in results:
+                            abandon(result)
+            except JobCancelled:
+                pass
+            except CypherError as e:
+                if not job.cancelled:
+                    job.error = u"{}: {}".format(e.title, e.message)
+            except Exception as e:
+                if not job.cancelled:
+                    job.error = u"{}: {}".format(e.__class__.__name__, e)
+            finally:
+                writer.flush()
+                if file:
+                    output.close()
+                self.invalidate_cache()
+                job.finished = timer()
+
+        self.jobs[job.id] = job
+        job.start(work)
+        click.secho(u"[{}] started".format(job.id), err=True, fg=self.meta_colour)
+
+    def show_jobs(self, **kwargs):
+        table = Table(["job", "status", "time", "records", "statement"])
+        for job_id, job in sorted(self.jobs.items()):
+            table.append((job_id, job.status, job.elapsed, job.record_count, abbreviate(job.statement)))
+        table.echo(header_style={"fg": self.meta_colour, "bold": True})
+        click.secho(u"({} job{})".format(len(self.jobs), "" if len(self.jobs) == 1 else "s"),
+                    err=True, fg=self.meta_colour, bold=True)
+
+    def find_jobs(self, args):
+        if not args:
+            return [job for _, job in sorted(self.jobs.items())]
+        jobs = []
+        for arg in args:
+            try:
+                jobs.append(self.jobs[int(arg.lstrip("[").rstrip("]"))])
+            except (KeyError, ValueError):
+                click.secho(u"No such job: {}".format(arg), err=True, fg=self.err_colour)
+        return jobs
 
-    def set_csv_result_writer(self, **kwargs):
-        self.result_writer = CSVResultWriter()
+    def wait_jobs(self, *args, **kwargs):
+        """ Wait for jobs (or all jobs) to finish, writing out the output
+        captured for each.
+        """
+        for job in self.find_jobs(args):
+            try:
+                # Wait in short steps so that Ctrl+C is noticed
+                while not job.wait(0.1):
+                    pass
+            except KeyboardInterrupt:
+                click.secho(u"[{}] still running".format(job.id), err=True, fg=self.meta_colour)
+                return
+            if job.file_name:
+                where = u" to {}".format(job.file_name)
+            else:
+                where = u""
+                click.echo(job.output.getvalue(), nl=False)
+            click.secho(u"[{}] {}{} ({} record{}{} in {:.3f}s)".format(
+                job.id, job.status, u": " + job.error if job.error else u"",
+                job.record_count, "" if job.record_count == 1 else "s", where, job.elapsed),
+                err=True, fg=self.err_colour if job.error else self.meta_colour, bold=True)
+            del self.jobs[job.id]
+
+    def cancel_jobs(self, *args, **kwargs):
+        """ Cancel jobs (or all jobs). Reading stops on the client and the
+        server is asked to stop running each query, if it supports that.
+        """
+        from .jobs import KILL_QUERY
+        for job in self.find_jobs(args):
+            if job.finished is not None:
+                continue
+            job.cancelled = True
+            try:
+                with self.driver.session() as session:
+                    killed = len(list(session.run(KILL_QUERY, {"marker": job.marker})))
+            except CypherError as e:
+                click.secho(u"[{}] could not stop server query ({})".format(job.id, e.message),
+                            err=True, fg=self.err_colour)
+            else:
+                click.secho(u"[{}] cancelling ({} server quer{} stopped)".format(
+                    job.id, killed, "y" if killed == 1 else "ies"), err=True, fg=self.meta_colour)
+
+    def import_csv(self, *args, **kwargs):
+        if len(args) != 2 or not args[1]:
+            click.secho("Usage: /import FILE [batch=N] [workers=N] [delimiter=CHAR] STATEMENT",
+                        err=True, fg=self.err_colour)
+            return
+        self.load_csv(args[0], args[1], batch=int(kwargs.get("batch", 1000)),
+                      workers=int(kwargs.get("workers", 1)), delimiter=kwargs.get("delimiter"))
+
+    def load_csv(self, file_name, statement, batch=1000, workers=1, delimiter=None):
+        """ Stream rows from a local CSV or TSV file into the database.
+
+        Rows are read as maps keyed by the header fields and are grouped
+        into lists of up to `batch` rows. Each list is passed to
+        `statement` as the `rows` parameter in its own write transaction,
+        typically for use with `UNWIND $rows AS row`. Up to `workers`
+        sessions are used concurrently.
+
+        :returns: number of rows loaded
+        """
+        if delimiter is None:
+            delimiter = u"\t" if file_name.lower().endswith((".tsv", ".tab")) else u","
+        elif delimiter.lower() in (u"tab", u"\\t"):
+            delimiter = u"\t"
+        batches = Queue(maxsize=2 * workers)
+        errors = []
+        writer = NullResultWriter()
+        counts = [0, 0]
+        lock = Lock()
+
+        def load(session, batch_no, rows):
+            record_count = session.write_transaction(lambda tx: self.run_cypher(
+                tx.run, statement, dict(self.parameters, rows=rows), line_no=batch_no, writer=writer))
+            with lock:
+                counts[0] += len(rows)
+                counts[1] += record_count
+
+        def work():
+            with self.private_session(WRITE_ACCESS) as session:
+                while True:
+                    item = batches.get()
+                    if item is None:
+                        break
+                    if not errors:
+                        try:
+                            load(session, *item)
+                        except Exception as error:
+                            errors.append(error)
+
+        t0 = timer()
+        threads = [Thread(target=work) for _ in range(max(1, workers))]
+        for thread in threads:
+            thread.start()
+        try:
+            with open_csv(expanduser(file_name)) as f:
+                for item in enumerate(read_batches(f, batch, delimiter), start=1):
+                    if errors:
+                        break
+                    batches.put(item)
+        finally:
+            for _ in threads:
+                batches.put(None)
+            for thread in threads:
+                thread.join()
+            self.invalidate_cache()
+        if errors:
+            raise errors[0]
+        click.secho(u"({} row{} loaded from {} with {} record{} returned in {:.3f}s)".format(
+            counts[0], "" if counts[0] == 1 else "s", file_name,
+            counts[1], "" if counts[1] == 1 else "s", timer() - t0), err=True, fg=self.meta_colour, bold=True)
+        return counts[0]
+
+    def set_csv_result_writer(self, buffer=None, **kwargs):
+        self.result_writer = CSVResultWriter(self.export_file, buffer_size=buffer)
 
     def set_tabular_result_writer(self, **kwargs):
-        self.result_writer = TabularResultWriter()
+        self.result_writer = TabularResultWriter(self.export_file)
 
-    def set_tsv_result_writer(self, **kwargs):
-        self.result_writer = TSVResultWriter()
+    def set_tsv_result_writer(self, buffer=None, **kwargs):
+        self.result_writer = TSVResultWriter(self.export_file, buffer_size=buffer)
+
+    def set_jsonl_result_writer(self, buffer=None, **kwargs):
+        self.result_writer = JSONLinesResultWriter(self.export_file, buffer_size=buffer)
+
+    def set_json_array_result_writer(self, buffer=None, **kwargs):
+        self.result_writer = JSONArrayResultWriter(self.export_file, buffer_size=buffer)
+
+    def export(self, *args, **kwargs):
+        """ Redirect result output to a file, optionally gzip compressed,
+        or back to stdout if no file is given.
+        """
+        self.close_export()
+        if args:
+            file_name = expanduser(args[0])
+            if "gzip" in args[1:] or file_name.endswith(".gz"):
+                from gzip import GzipFile
+                self.export_file = TextIOWrapper(GzipFile(file_name, "wb"), encoding="utf-8", newline="")
+            else:
+                self.export_file = io_open(file_name, "w", encoding="utf-8", newline="")
+            click.secho(u"Exporting results to {}".format(file_name), err=True, fg=self.meta_colour)
+        writer = self.result_writer
+        self.result_writer = writer.__class__(self.export_file, buffer_size=writer.buffer_size)
+
+    def close_export(self):
+        if self.export_file is not None:
+            self.result_writer.flush()
+            self.export_file.close()
+            self.export_file = None
 
     def config(self, **kwargs):
         with self.driver.session() as session:
@@ -373,6 +1740,143 @@ class ConsoleError(Exception):
     pass
 
 
+def is_parameter_declaration(statement):
+    """ Check whether a statement is a `/param` declaration rather than
+    Cypher.
+    """
+    return statement.split(None, 1)[0] in (u"/param", u":param") if statement else False
+
+
+def group_statements(statements):
+    """ Gather consecutive Cypher statements into lists so that each
+    list can be pipelined. Transaction control statements, and Cypher
+    statements that stand alone, are passed through unchanged.
+    """
+    group = []
+    for statement in statements:
+        if statement.upper() in ("BEGIN", "COMMIT", "ROLLBACK"):
+            for item in ([group] if len(group) > 1 else group):
+                yield item
+            group = []
+            yield statement
+        else:
+            group.append(statement)
+    for item in ([group] if len(group) > 1 else group):
+        yield item
+
+
+def strip_comments(source):
+    """ Remove any comments, and the space around them, from the start
+    of some source text.
+    """
+    while True:
+        source = source.lstrip()
+        if source.startswith(u"//"):
+            _, _, source = source.partition(u"\n")
+        elif source.startswith(u"/*"):
+            _, _, source = source.partition(u"*/")
+        else:
+            return source
+
+
+def split_statement_command(source, arg_count):
+    """ Split a command that ends with a Cypher statement into positional
+    arguments, options and the statement itself. The first `arg_count`
+    words are taken as positional arguments and any `key=value` words
+    that follow as options; the remainder is left untouched.
+
+    :returns: triple of (args, kwargs, statement)
+    """
+    args = []
+    kwargs = {}
+    rest = source.split(None, 1)[1] if len(source.split(None, 1)) > 1 else u""
+    while rest:
+        parts = rest.split(None, 1)
+        word = parts[0]
+        if len(args) < arg_count:
+            args.append(word)
+        elif OPTION.match(word):
+            key, _, value = word.partition("=")
+            kwargs[key] = value
+        else:
+            break
+        rest = parts[1] if len(parts) > 1 else u""
+    return args, kwargs, rest.strip()
+
+
+def abbreviate(statement, width=50):
+    """ Shorten a statement to its first line, and at most `width` characters.
+    """
+    lines = statement.splitlines() or [u""]
+    if len(lines) == 1 and len(lines[0]) <= width:
+        return lines[0]
+    return lines[0][:width - 3] + u"..."
+
+
+def error_str(error):
+    if isinstance(error, CypherError):
+        return u"{}: {}".format(error.title, error.message)
+    return u"{}: {}".format(error.__class__.__name__, error)
+
+
+def parse_bool(value):
+    """ Interpret a command option value as a boolean.
+    """
+    value = value.lower()
+    if value in ("yes", "y", "on", "true", "1"):
+        return True
+    elif value in ("no", "n", "off", "false", "0"):
+        return False
+    else:
+        raise ValueError("Expected yes/no, on/off or true/false, not {!r}".format(value))
+
+
+def terminal_height():
+    try:
+        from shutil import get_terminal_size
+    except ImportError:
+        from click import get_terminal_size
+    return get_terminal_size()[1]
+
+
+def discard(result, lexer):
+    """ Abandon the remainder of a result.
+
+    If the result is that of a read outside of an explicit transaction,
+    the connection carrying it is closed, so that the server stops
+    sending records and no more are fetched. Closing the connection
+    would roll back a write or lose an explicit transaction, so
+    otherwise the remaining records are still received but are dropped
+    as they arrive, without being made into records.
+    """
+    session = getattr(result, "session", None)
+    connection = getattr(session, "_connection", None)
+    if connection is None:
+        # Held locally, or already received in full
+        result.consume()
+        return
+    statement = getattr(result, "_metadata", {}).get("statement")
+    if session.has_transaction() or statement is None or is_write(lexer, statement):
+        for response in connection.responses:
+            response.handlers.pop("on_records", None)
+        result.consume()
+    else:
+        abandon(result)
+
+
+def abandon(result):
+    """ Stop a result being received, by closing the connection carrying
+    it, and detach it from its session without fetching anything more.
+    Any transaction on that connection is lost.
+    """
+    session = getattr(result, "session", None)
+    connection = getattr(session, "_connection", None)
+    if connection is not None:
+        connection.close()
+    if session is not None:
+        result.detach(sync=False)
+
+
 def address_str(address):
     if len(address) == 4:  # IPv6
         return "[{}]:{}".format(*address)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from csv import reader as csv_reader
+from io import open as io_open
+from itertools import islice
+import sys
+
+
+if sys.version_info >= (3,):
+
+    def open_csv(file_name):
+        return io_open(file_name, "r", encoding="utf-8", newline="")
+
+    def decode_row(row):
+        return row
+
+else:
+
+    def open_csv(file_name):
+        return open(file_name, "rb")
+
+    def decode_row(row):
+        return [value.decode("utf-8") for value in row]
+
+
+def read_batches(f, size, delimiter=u","):
+    """ Read rows from a CSV file in batches. Each row is returned as a
+    dictionary keyed by the fields of the header row.
+
+    :param f: open CSV file, as returned by :func:`open_csv`
+    :param size: maximum number of rows per batch
+    :param delimiter: field delimiter
+    :returns: iterator of row lists
+    """
+    rows = csv_reader(f, delimiter=str(delimiter))
+    try:
+        keys = decode_row(next(rows))
+    except StopIteration:
+        return
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            break
+        batch = [dict(zip(keys, decode_row(row))) for row in chunk if row]
+        if batch:
+            yield batch
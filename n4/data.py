@@ -16,12 +16,17 @@
 # limitations under the License.
 
 
+from base64 import b64encode
+from collections import OrderedDict
+from json import JSONEncoder
 import sys
+from timeit import default_timer as timer
 
 import click
-from cypy.encoding import cypher_repr, cypher_str
+from cypy.encoding import cypher_escape, cypher_repr, cypher_str
+from neo4j.v1.types import Node, Relationship, Path
 
-from .table import Table
+from .table import Table, emit, is_tty
 
 
 if sys.version_info >= (3,):
@@ -42,7 +47,66 @@ else:
     MAP = dict
 
 
+class TimedResult(object):
+    """ Wrapper for a result that measures the time spent waiting for,
+    receiving and decoding records, as distinct from the time spent by
+    a :class:`.ResultWriter` formatting them.
+    """
+
+    def __init__(self, result):
+        self._result = result
+        self._records = iter(result)
+        #: Seconds spent fetching records.
+        self.fetch_time = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t0 = timer()
+        try:
+            return next(self._records)
+        finally:
+            self.fetch_time += timer() - t0
+
+    next = __next__
+
+    def peek(self):
+        t0 = timer()
+        try:
+            return self._result.peek()
+        finally:
+            self.fetch_time += timer() - t0
+
+
 class ResultWriter(object):
+    """ Base class for all result writers.
+
+    Output is collected into a buffer and written out in a single call.
+    When attached to a terminal, the buffer is flushed at the end of each
+    page; otherwise, it is only flushed once more than `buffer_size`
+    characters have been collected, or when :meth:`flush` is called.
+    """
+
+    #: Number of characters to collect before writing out.
+    buffer_size = 65536
+
+    #: Index of graph entities already written, if entities seen before
+    #: are to be written by reference alone.
+    entities = None
+
+    def __init__(self, file=None, buffer_size=None):
+        self.file = file
+        if buffer_size is not None:
+            self.buffer_size = int(buffer_size)
+        self.styled = is_tty(file)
+        self._buffer = []
+        self._buffered = 0
+        #: Number of characters written out so far.
+        self.written = 0
 
     def write_header(self, result):
         """ Write a header for `result.
@@ -60,77 +124,282 @@ class ResultWriter(object):
         """
         pass
 
+    def flush(self):
+        """ Write out any buffered output.
+        """
+        if not self._buffer:
+            return
+        data = u"".join(self._buffer)
+        del self._buffer[:]
+        self._buffered = 0
+        self.written += len(data)
+        emit(data, self.file, self.styled)
+
+    def _write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def _write_page(self, result, limit):
+        count = 0
+        for count, record in enumerate(result, start=1):
+            self.write_record(record)
+            if count == limit:
+                break
+        if self.styled:
+            self.flush()
+        return count
+
+
+class NullResultWriter(ResultWriter):
+    """ Result writer that counts records but discards them.
+    """
+
+    def write(self, result, limit):
+        count = 0
+        for count, _ in enumerate(result, start=1):
+            if count == limit:
+                break
+        return count
+
+
+class EntityIndex(object):
+    """ Bounded record of the graph entities written so far. Once the
+    index is full, the entity least recently seen is forgotten, and is
+    written in full again if it is seen again.
+    """
+
+    #: Maximum number of entities remembered.
+    capacity = 10000
+
+    def __init__(self, capacity=None):
+        if capacity is not None:
+            self.capacity = int(capacity)
+        self._seen = OrderedDict()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def seen(self, key):
+        """ Note that an entity has been seen.
+
+        :returns: :const:`True` if it had already been seen
+        """
+        seen = self._seen.pop(key, False)
+        self._seen[key] = True
+        if not seen and len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+        return seen
+
+
+def endpoints(relationship):
+    """ Return the IDs of the start and end nodes of a relationship.
+    """
+    if hasattr(relationship, "start_node"):
+        return relationship.start_node.id, relationship.end_node.id
+    return relationship.start, relationship.end
+
+
+def properties_str(entity):
+    if not len(entity):
+        return u""
+    return u" {" + u", ".join(cypher_escape(key) + u": " + cypher_repr(value)
+                              for key, value in entity.items()) + u"}"
+
+
+def node_str(node, entities):
+    if entities.seen((u"node", node.id)):
+        return u"(_{})".format(node.id)
+    return u"(_{}{}{})".format(node.id, u"".join(u":" + cypher_escape(label) for label in sorted(node.labels)),
+                               properties_str(node))
+
+
+def relationship_str(relationship, entities):
+    if entities.seen((u"relationship", relationship.id)):
+        return u"[_{}]".format(relationship.id)
+    return u"[_{}:{}{}]".format(relationship.id, cypher_escape(relationship.type), properties_str(relationship))
+
+
+def entity_str(value, entities):
+    """ Encode a node, relationship or path, or a list of these, as
+    Cypher-like text. Each entity is written in full on first sight and
+    by reference alone, as `(_ID)` or `[_ID]`, after that.
+
+    :param entities: :class:`.EntityIndex` of entities already written
+    :returns: text, or :const:`None` if the value is not a graph entity
+    """
+    if isinstance(value, Node):
+        return node_str(value, entities)
+    elif isinstance(value, Relationship):
+        start, end = endpoints(value)
+        return u"(_{})-{}->(_{})".format(start, relationship_str(value, entities), end)
+    elif isinstance(value, Path):
+        nodes = value.nodes
+        pieces = [node_str(nodes[0], entities)]
+        for i, relationship in enumerate(value.relationships):
+            if endpoints(relationship)[0] == nodes[i].id:
+                pieces.append(u"-" + relationship_str(relationship, entities) + u"->")
+            else:
+                pieces.append(u"<-" + relationship_str(relationship, entities) + u"-")
+            pieces.append(node_str(nodes[i + 1], entities))
+        return u"".join(pieces)
+    elif isinstance(value, LIST) and any(isinstance(item, (Node, Relationship, Path)) for item in value):
+        return u"[" + u", ".join(entity_str(item, entities) or cypher_repr(item) for item in value) + u"]"
+    else:
+        return None
+
 
 class TabularResultWriter(ResultWriter):
+    """ Result writer that formats each page of records as a table.
+
+    Cells can be limited to `max_width` characters per line and
+    `max_height` lines. The full values of cells shortened on the last
+    page written are kept in :attr:`shortened`, keyed by record number
+    and column.
+    """
+
+    #: Maximum number of characters per line of a cell, if any.
+    max_width = None
+
+    #: Maximum number of lines in a cell, if any.
+    max_height = None
+
+    def __init__(self, file=None, buffer_size=None):
+        super(TabularResultWriter, self).__init__(file, buffer_size)
+        self.keys = []
+        self.record_count = 0
+        self.shortened = {}
+        self.shortened_count = 0
+
+    def write_header(self, result):
+        self.keys = result.keys()
+        self.record_count = 0
+        self.shortened = {}
+        self.shortened_count = 0
 
     def write(self, result, limit):
-        table = Table(result.keys())
+        table = Table(result.keys(), max_width=self.max_width, max_height=self.max_height)
+        rows = []
+        entities = self.entities
         for count, record in enumerate(result, start=1):
-            table.append(record.values())
+            values = record.values()
+            if entities is not None:
+                values = [entity_str(value, entities) or value for value in values]
+            table.append(values)
+            rows.append(values)
             if count == limit:
                 break
-        table.echo(header_style={"fg": "cyan", "bold": True})
-        click.echo()
+        self._write(table.render({"fg": "cyan", "bold": True}, self.styled) + u"\n")
+        if self.styled:
+            self.flush()
+        self.shortened = dict(((self.record_count + row + 1, column), rows[row][column])
+                              for row, column in table.shortened)
+        self.shortened_count += len(table.shortened)
+        self.record_count += table.size()
         return table.size()
 
 
 class CSVResultWriter(ResultWriter):
 
     def write_header(self, result):
-        click.secho(u",".join(result.keys()), nl=False, fg="cyan", bold=True)
-        click.echo(u"\r\n", nl=False)
+        header = u",".join(result.keys())
+        if self.styled:
+            header = click.style(header, fg="cyan", bold=True)
+        self._write(header + u"\r\n")
 
     def write(self, result, limit):
-        count = 0
-        for count, record in enumerate(result, start=1):
-            self.write_record(record)
-            if count == limit:
-                break
-        return count
+        return self._write_page(result, limit)
 
     def write_record(self, record):
-        for i, value in enumerate(record.values()):
-            if i > 0:
-                click.echo(u",", nl=False)
-            self.write_value(value)
-        click.echo(u"\r\n", nl=False)
+        self._write(u",".join(map(self.encode_value, record.values())) + u"\r\n")
 
-    def write_value(self, value):
+    def encode_value(self, value):
         if value is None:
-            return
+            return u""
+        if self.entities is not None:
+            value = entity_str(value, self.entities) or value
         if isinstance(value, STRING):
             if u',' in value or u'"' in value or u"\r" in value or u"\n" in value:
-                escaped_value = u'"' + value.replace(u'"', u'""') + u'"'
-                click.echo(escaped_value, nl=False)
+                return u'"' + value.replace(u'"', u'""') + u'"'
             else:
-                click.echo(cypher_repr(value, quote=u'"'), nl=False)
+                return cypher_repr(value, quote=u'"')
         else:
-            click.echo(cypher_str(value), nl=False)
+            return cypher_str(value)
 
 
 class TSVResultWriter(ResultWriter):
 
     def write_header(self, result):
-        click.secho(u"\t".join(result.keys()), nl=False, fg="cyan", bold=True)
-        click.echo(u"\r\n", nl=False)
+        header = u"\t".join(result.keys())
+        if self.styled:
+            header = click.style(header, fg="cyan", bold=True)
+        self._write(header + u"\r\n")
 
     def write(self, result, limit):
-        count = 0
-        for count, record in enumerate(result, start=1):
-            self.write_record(record)
-            if count == limit:
-                break
-        return count
+        return self._write_page(result, limit)
 
     def write_record(self, record):
-        for i, value in enumerate(record.values()):
-            if i > 0:
-                click.echo(u"\t", nl=False)
-            self.write_value(value)
-        click.echo(u"\r\n", nl=False)
+        self._write(u"\t".join(map(self.encode_value, record.values())) + u"\r\n")
 
-    def write_value(self, value):
+    def encode_value(self, value):
+        if self.entities is not None:
+            value = entity_str(value, self.entities) or value
         if isinstance(value, STRING):
-            click.echo(cypher_repr(value, quote=u'"'), nl=False)
+            return cypher_repr(value, quote=u'"')
         else:
-            click.echo(cypher_str(value), nl=False)
+            return cypher_str(value)
+
+
+def json_default(value):
+    """ Structural JSON representation for values that have no direct
+    JSON equivalent, such as graph entities. Byte arrays are written as
+    base64 strings, from which they can be decoded exactly.
+    """
+    if isinstance(value, Node):
+        return {"id": value.id, "labels": sorted(value.labels), "properties": dict(value.items())}
+    elif isinstance(value, Relationship):
+        start, end = endpoints(value)
+        return {"id": value.id, "type": value.type, "start": start, "end": end,
+                "properties": dict(value.items())}
+    elif isinstance(value, Path):
+        return {"nodes": list(value.nodes), "relationships": list(value.relationships)}
+    elif isinstance(value, BYTES):
+        return b64encode(bytes(value)).decode("ascii")
+    else:
+        return STRING(value)
+
+
+class JSONLinesResultWriter(ResultWriter):
+    """ Writer for JSON Lines output, with one object per record.
+    Nodes, relationships and paths are written as nested objects.
+    """
+
+    def __init__(self, file=None, buffer_size=None):
+        super(JSONLinesResultWriter, self).__init__(file, buffer_size)
+        self.encode_value = JSONEncoder(ensure_ascii=False, separators=(u",", u":"),
+                                        default=json_default).encode
+        self._keys = []
+
+    def write_header(self, result):
+        self._keys = [self.encode_value(key) + u":" for key in result.keys()]
+
+    def write(self, result, limit):
+        return self._write_page(result, limit)
+
+    def write_record(self, record):
+        self._write(u"{" + u",".join(key + self.encode_value(value)
+                                     for key, value in zip(self._keys, record.values())) + u"}\n")
+
+
+class JSONArrayResultWriter(JSONLinesResultWriter):
+    """ Writer for compact JSON Lines output. A header object lists the
+    column names, after which each record is written as an array of
+    values in column order.
+    """
+
+    def write_header(self, result):
+        self._write(u'{"columns":' + self.encode_value(list(result.keys())) + u"}\n")
+
+    def write_record(self, record):
+        self._write(self.encode_value(list(record.values())) + u"\n")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from contextlib import contextmanager
+from io import open as io_open
+import os
+from os.path import abspath, dirname, exists
+from tempfile import mkstemp
+
+try:
+    from os import replace
+except ImportError:
+    # Python 2 only renames over an existing file on POSIX
+    from os import rename as replace
+
+
+@contextmanager
+def atomic_write(file_name, binary=False, sync=False):
+    """ Write a file by way of a temporary file in the same directory,
+    which then replaces it in one step, so that readers see either the
+    old file or the new one in full. The temporary file is removed if
+    anything fails. An existing file keeps its permissions.
+
+    :param file_name: file to write
+    :param binary: open for bytes rather than UTF-8 text
+    :param sync: flush the data to disk before replacing the file
+    :returns: context manager giving the open temporary file
+    """
+    fd, temp_name = mkstemp(suffix=".tmp", dir=dirname(abspath(file_name)))
+    try:
+        with (os.fdopen(fd, "wb") if binary else io_open(fd, "w", encoding="utf-8")) as f:
+            yield f
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        try:
+            os.chmod(temp_name, os.stat(file_name).st_mode & 0o7777)
+        except OSError:
+            pass
+        replace(temp_name, file_name)
+    finally:
+        if exists(temp_name):
+            os.remove(temp_name)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from os import getpid
+from threading import Thread
+from timeit import default_timer as timer
+
+
+#: Statement used to stop the server side of a cancelled job.
+KILL_QUERY = (u"CALL dbms.listQueries() YIELD queryId, query "
+              u"WITH queryId, query WHERE query STARTS WITH $marker "
+              u"CALL dbms.killQuery(queryId) YIELD message "
+              u"RETURN message")
+
+
+class JobCancelled(Exception):
+    """ Raised within a job when it has been cancelled.
+    """
+
+
+class Job(object):
+    """ Statement running in the background on a thread and session of
+    its own, with output captured to a text file or buffer.
+    """
+
+    def __init__(self, job_id, statement, output, file_name=None):
+        self.id = job_id
+        self.statement = statement
+        self.output = output
+        self.file_name = file_name
+        self.record_count = 0
+        self.error = None
+        self.cancelled = False
+        self.started = timer()
+        self.finished = None
+        self._thread = None
+
+    @property
+    def marker(self):
+        """ Comment prefixed to the statement so that the server side of
+        the job can be found among the running queries.
+        """
+        return u"/* n4 job {}:{} */".format(getpid(), self.id)
+
+    @property
+    def status(self):
+        if self.finished is None:
+            return u"cancelling" if self.cancelled else u"running"
+        elif self.cancelled:
+            return u"cancelled"
+        elif self.error:
+            return u"failed"
+        else:
+            return u"done"
+
+    @property
+    def elapsed(self):
+        return (self.finished or timer()) - self.started
+
+    def records(self, result):
+        """ Wrap a result so that records are counted as they are read,
+        and reading stops once the job has been cancelled.
+        """
+        return JobResult(self, result)
+
+    def start(self, target):
+        self._thread = Thread(target=target)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """ Wait for the job to finish.
+
+        :returns: :const:`True` if the job has finished
+        """
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+class JobResult(object):
+
+    def __init__(self, job, result):
+        self._job = job
+        self._result = result
+        self._records = iter(result)
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._job.cancelled:
+            raise JobCancelled()
+        record = next(self._records)
+        self._job.record_count += 1
+        return record
+
+    next = __next__
@@ -40,6 +40,13 @@ regular Cypher, transaction control keywords or slash commands. Multiple
 Cypher statements can be entered on the same line separated by semicolons.
 These will be executed within a single transaction.
 
+Scripts can be run with -f FILE, or piped in with -f -. Statements are
+split and run as they are read, so scripts of any size can be run in
+constant memory. Slash commands in scripts must end with a semicolon, as
+for Cypher statements. The exit status is non-zero if any statement
+fails, and --progress writes a line of JSON for each statement for use
+by other tools.
+
 For a handy Cypher reference, see:
 
   https://neo4j.com/docs/cypher-refcard/current/
@@ -56,17 +63,246 @@ Slash commands provide access to supplementary functionality.
 Playback commands:
   /r FILE   load and run a Cypher file in a read transaction
   /w FILE   load and run a Cypher file in a write transaction
+  /p FILE.. run several Cypher files in parallel, one transaction each
+  /import FILE STATEMENT
+            load rows from a CSV or TSV file in batches
+
+Playback files are read incrementally. To commit in chunks rather than
+as a single transaction, pass `batch=N` (statements per commit) and/or
+`every=SECONDS`. A checkpoint is kept in FILE.checkpoint after each commit
+so that a failed run can be continued with `resume=yes`, e.g. `/w FILE
+batch=1000 resume=yes`.
+
+Parallel playback accepts file names or glob patterns and runs each file
+in its own session, using up to `workers=N` concurrent sessions (default
+4) in write mode (or read mode with `mode=r`). Result output is written
+to per-file logs in the directory given by `logs=DIR`, or discarded if
+omitted. A summary of timings and record counts is shown at the end.
+The same can be done from the command line using the --play, --workers
+and --logs options.
+
+CSV import streams the rows of a local file and passes them in lists of
+up to `batch=N` rows (default 1000) to the statement as the `rows`
+parameter, each list in its own write transaction. Up to `workers=N`
+sessions (default 1) are used concurrently. For example:
+
+\b
+  /import people.csv batch=5000 UNWIND $rows AS row CREATE (:Person {{name: row.name}})
+
+The field delimiter is a comma, or a tab for .tsv files, and can be set
+with `delimiter=CHAR`. The command line equivalent is --import FILE
+STATEMENT, with --batch-size and --workers.
+
+\b
+Parameter commands:
+  /param              list all query parameters
+  /param NAME=VALUE   set a query parameter
+  /unparam NAME       remove a query parameter
+
+Parameters are passed with every statement, so a query can refer to
+$name instead of using literal values, allowing the server to reuse its
+cached plan. Each VALUE is a Cypher expression evaluated by the server,
+e.g. `/param ids=[1, 2, 3]`. Parameters can also be set on the command
+line with --param NAME=VALUE, and playback files can declare their own
+with `/param NAME=VALUE;` statements.
+
+\b
+Background commands:
+  /bg STATEMENT       run a statement in the background
+  /jobs               list background jobs
+  /wait [N...]        wait for jobs and show their output
+  /cancel [N...]      cancel jobs
+
+Each background job runs on a session of its own, leaving the console
+free for other work. Output is held in memory until the job is waited
+for, or written to a file instead with `/bg file=FILE STATEMENT`. The
+job list shows the status, running time and records read so far for
+each job. Jobs are numbered from 1; /wait and /cancel apply to all jobs
+unless given job numbers. Cancelling a job also asks the server to
+terminate its query, where the dbms.killQuery procedure is available.
+
+\b
+Tuning commands:
+  /bench STATEMENT    run a statement repeatedly and report latencies
+  /explain STATEMENT  show the execution plan for a statement
+  /profile STATEMENT  run a statement and show its profiled plan
+  /pipeline on|off    send runs of statements together
+  /routing on|off     send reads to readers and writes to writers
+  /retry [N|off]      show or set the retry policy for transient errors
+
+The benchmark runs `n=N` iterations (default 100) or for `time=SECONDS`
+from `c=N` concurrent sessions (default 1), after an optional `warmup=N`
+iterations. Throughput, latency percentiles and errors are reported. Use
+`file=FILE` to run the statements of a file on each iteration instead.
+For example, `/bench n=1000 c=8 warmup=100 MATCH (a:Person) RETURN a`.
+
+Profiled plans show the rows and db hits for each operator along with
+its share of the total db hits. The operators with the most db hits are
+highlighted (the top 3 by default, or set with `top=N`).
+
+With pipelining on, consecutive statements entered together are all sent
+before any results are read, costing one network round trip instead of
+one per statement. Outside of an explicit transaction, such statements
+run together in a transaction of their own, so a failure rolls back all
+of them. Use --pipeline to do the same for statements given on the
+command line.
+
+Routing is on by default. Each statement outside of an explicit
+transaction is classified as a read or a write from its keywords and
+the procedures it calls, and run with the matching access mode, so that
+a cluster can serve reads from its replicas. Reads that follow a write
+wait until that write is visible to them. The status line shows how
+each statement was routed. Explicit transactions are always run as
+writes.
+
+Statements run outside of an explicit transaction, and playback files,
+are retried after transient errors such as deadlocks or a change of
+cluster leader. By default, up to 2 retries are made within 30 seconds,
+waiting 0.1s before the first and twice as long before each one after,
+give or take 20%. These can be changed with the `delay`, `factor`,
+`jitter` and `budget` options, e.g. `/retry 5 delay=0.5 budget=60`, or
+with --retries. A chunked playback retries only the chunk that failed.
+Retries and the time they took are shown in the status line and in
+playback summaries. Statements are only retried if they fail before any
+records have been returned.
 
 \b
 Formatting commands:
   /csv      format output as comma-separated values
   /table    format output in a table
   /tsv      format output as tab-separated values
+  /jsonl    format output as JSON Lines, one object per record
+  /jsona    format output as JSON Lines, one array per record
+  /export FILE [gzip]
+            write output to a file instead of stdout
+  /dedup on|off
+            write graph entities seen before by reference
+
+CSV, TSV and JSON output is buffered and written in large blocks when
+not attached to a terminal. The buffer size (in characters) can be set
+with the `buffer` option, e.g. `/csv buffer=1048576`.
+
+JSON output writes nodes, relationships and paths as nested objects, and
+byte arrays as base64 strings. The /jsona format is row-oriented: a
+header object lists the columns, then each record is an array of values
+in column order. Use /export with no file to return to stdout. Files
+ending with .gz, or exported with the gzip option, are compressed.
+
+With deduplication on, table, CSV and TSV output writes nodes,
+relationships and paths in a Cypher-like form, such as
+(_1:Person)-[_7:KNOWS]->(_2:Person). Each entity is written in full,
+with its labels or type and its properties, the first time it appears in
+a result. After that it is written by ID alone, as (_1) or [_7].
+Up to 10000 entities are remembered per result, or set this with
+`/dedup on size=N`. An entity that has been forgotten is written in full
+again.
+
+\b
+Paging commands:
+  /pager on|off       page results one screen at a time
+  /pagesize N|auto    set the number of records per page
+  /cellsize W [H]|off set the maximum width and height of table cells
+  /expand RECORD COLUMN
+                      show a shortened table cell in full
+
+The pager is switched on for interactive consoles. It shows one screen
+of records at a time and fetches more only when asked; stopping early
+discards the remainder of the result. For a read outside of a
+transaction, the connection is closed so that the rest is never sent.
+Otherwise, results are written in pages whose size adapts to
+throughput unless fixed with /pagesize or the --page-size option.
+
+Table cells are limited to 200 characters per line and 20 lines by
+default, so that a large value cannot flood the screen or the memory of
+the console. Shortened cells end with "..." and only the part of each
+value that is shown is ever formatted. /expand shows one in full, such
+as `/expand 3 name` for the "name" column of the third record; this
+works for cells on the last page written.
+
+\b
+Retained result commands:
+  /retain on|off      keep the last result for the commands below
+  /sort [-]COLUMN...  sort the retained result
+  /filter [EXPRESSION]
+                      narrow the retained result, or show all of it again
+  /top N COLUMN       show the records with the greatest values in a column
+  /count [COLUMN]     count the records, or the records for each value in
+                      a column
+
+With retention on, a copy of the records of the last result written to
+the console is kept, so that it can be sorted and filtered again without
+going back to the server. Values are held in a compact serialised form,
+row by row in a single block with the offsets of each column alongside,
+and the block moves to a temporary file once it passes 64MB (or set this
+with `/retain on spill=BYTES`). Graph entities are kept as maps.
+Only records that were written out are kept, so a result cut short by
+the pager is kept in part.
+
+Columns are given by name or by number, counting from 1. Prefix a column
+with `-` to sort it in descending order, e.g. `/sort -age name`.
+`/filter` takes an expression in Python syntax in which each column is
+available by name, or as `row["name"]`, e.g.
+`/filter age > 30 and city == "York"`. Only comparisons (including `in`
+and `is`), arithmetic, literals, lists and indexing are allowed, combined
+with `and`, `or` and `not`; function calls and attribute access are not.
+An expression that fails for a record, such as a comparison with null,
+leaves that record out. Sorting and filtering carry on from the last
+sort or filter, until `/filter` with no expression shows all records in
+their original order again. `/top` and `/count` leave the order
+as it is.
 
 \b
 Information commands:
   /config   show Neo4j server configuration
   /kernel   show Neo4j kernel information
+  /timing on|off
+            show where the time for each statement is spent
+  /cache on|off|stats|clear
+            control the result cache and show its hit rate
+  /trace on|off|clear
+            record protocol activity in memory
+  /trace [dump [FILE]]
+            summarise the activity for each statement, or write it all out
+  /stats [on|off|reset]
+            show or control session statistics
+  /stats export FILE
+            write session statistics to a file
+
+With timing on, each status line is followed by a breakdown of the time
+spent by the server (from the result summary), on the network and
+decoding records, and rendering output.
+
+The result cache replays the results of repeated read statements without
+going to the server. Statements are matched ignoring comments, spacing
+and keyword case, along with their parameters. Statements that may write
+(including calls to procedures not known to be read-only) bypass the
+cache and clear it, as do all statements run within an explicit
+transaction. Scripts run with `/r`, `/w` or `/p`, imports and background
+jobs also clear the cache once finished. Options for `/cache on`
+are `size=N` entries (default 100), `ttl=SECONDS` (default 60), `rows=N`
+for the largest result kept (default 10000) and `dir=DIR` to keep results
+on disk for later runs; --cache and --cache-dir do the same from the
+command line. Results on disk are shared only between runs against the
+same server as the same user, and results holding nodes, relationships
+or paths are kept in memory only.
+
+Tracing records protocol messages, with timings, in memory rather than
+writing them out as --verbose does, so that it barely slows down the
+traffic it records. Only the most recent events are kept (100000 by
+default, or set with `/trace on size=N`). The summary shows, for each
+statement, the round trips made, messages sent and received, records
+received and the approximate size of the messages, as logged. Use
+--trace FILE to trace a whole run and write the trace out at the end.
+
+Session statistics are kept for interactive consoles, or when switched
+on with `/stats on` or --metrics. They count statements, records,
+characters of output written, errors and retries, with a latency
+histogram for each statement fingerprint. Statements share a fingerprint
+if they differ only in spacing, comments, keyword case and literal
+values. Statistics can be exported in Prometheus text format or as JSON
+(`format=json`), with `/stats export FILE` or with --metrics FILE, which
+also writes them every --metrics-interval seconds if set. Files are
+replaced in one step, so they can be collected safely at any time.
 
 Report bugs to n4@nige.tech\
 """.format(quick_help)
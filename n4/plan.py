@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from .table import Table
+
+
+def walk(plan, depth=0):
+    """ Iterate through a plan tree depth first, yielding a pair of
+    (depth, operator) for each operator.
+    """
+    yield depth, plan
+    for child in plan.children:
+        for item in walk(child, depth + 1):
+            yield item
+
+
+def plan_table(plan, hotspots=3, hot_style=None):
+    """ Build a table describing an execution plan, one row per operator.
+
+    For profiled plans, the operators with the most db hits are
+    highlighted with `hot_style`, and the share of the total db hits
+    spent in each operator is shown.
+
+    :param plan: plan or profiled plan from a result summary
+    :param hotspots: number of operators to highlight
+    :param hot_style: click style for highlighted operators
+    :returns: pair of (table, hotspot list), where each hotspot is a
+              triple of (operator type, db hits, share of total)
+    """
+    operators = list(walk(plan))
+    profiled = hasattr(plan, "db_hits")
+    if profiled:
+        table = Table(["operator", "rows", "est. rows", "db hits", "share", "variables"])
+        total = sum(operator.db_hits for _, operator in operators) or 1
+        ranked = sorted((operator for _, operator in operators if operator.db_hits),
+                        key=lambda operator: operator.db_hits, reverse=True)[:hotspots]
+    else:
+        table = Table(["operator", "est. rows", "variables"])
+        total = 1
+        ranked = []
+    for depth, operator in operators:
+        name = u"  " * depth + u"+" + operator.operator_type
+        estimated_rows = operator.arguments.get("EstimatedRows")
+        variables = u", ".join(sorted(operator.identifiers))
+        if profiled:
+            share = u"{:.1f}%".format(100.0 * operator.db_hits / total)
+            style = hot_style if any(operator is hot for hot in ranked) else None
+            table.append((name, operator.rows, estimated_rows, operator.db_hits, share, variables), style)
+        else:
+            table.append((name, estimated_rows, variables))
+    return table, [(operator.operator_type, operator.db_hits, float(operator.db_hits) / total)
+                   for operator in ranked]
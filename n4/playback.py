@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from codecs import getincrementaldecoder
+from json import dump as json_dump, load as json_load
+from os import remove
+from os.path import expanduser
+import re
+
+from pygments.token import Comment, Keyword, Number, String, Whitespace, Text
+
+
+QUOTES = u"'\"`"
+
+#: Tokens to look for in Cypher source outside of quotes and comments:
+#: the start of a comment, a quote, a semicolon or a run of other
+#: characters, whitespace aside.
+CODE_TOKEN = re.compile(u"//|/\\*|[;'\"`]|[^\\s;'\"`/]+|/")
+
+#: For each kind of quote or comment, the token that closes it and a
+#: pattern that finds that token or an escape sequence.
+CLOSING_TOKENS = {
+    u"'": (u"'", re.compile(u"\\\\.?|'", re.DOTALL)),
+    u'"': (u'"', re.compile(u'\\\\.?|"', re.DOTALL)),
+    u"`": (u"`", re.compile(u"`")),
+    u"//": (u"\n", re.compile(u"\n")),
+    u"/*": (u"*/", re.compile(u"\\*/")),
+}
+
+#: Words that mark a statement as one that may write.
+WRITE_KEYWORDS = {u"CREATE", u"MERGE", u"SET", u"DELETE", u"DETACH", u"REMOVE",
+                  u"DROP", u"LOAD", u"FOREACH"}
+
+#: Pattern matching any word that could make a statement one that may
+#: write, wherever it appears, as a cheap test ahead of lexing.
+WRITE_HINT = re.compile(u"\\b(?:{}|CALL)\\b".format(u"|".join(sorted(WRITE_KEYWORDS))), re.IGNORECASE)
+
+#: Procedures known not to write. Calls to any other procedure are
+#: taken to be writes, since there is no telling what they do.
+READ_PROCEDURES = {u"db.constraints", u"db.indexes", u"db.labels", u"db.propertykeys",
+                   u"db.relationshiptypes", u"db.schema", u"dbms.cluster.overview",
+                   u"dbms.cluster.role", u"dbms.components", u"dbms.functions",
+                   u"dbms.listconfig", u"dbms.listqueries", u"dbms.procedures",
+                   u"dbms.queryjmx", u"dbms.security.showcurrentuser",
+                   u"dbms.showcurrentuser"}
+
+
+def normalise(lexer, statement, literals=True):
+    """ Reduce a statement to a canonical form, without comments, with
+    all whitespace collapsed and with keywords in upper case, so that
+    trivially different versions of a statement compare equal.
+
+    :param literals: keep literal strings and numbers, rather than
+                     replacing each with `?`
+    """
+    words = []
+    for token_type, value in lexer.get_tokens(statement):
+        if token_type in Comment:
+            continue
+        elif token_type in Whitespace or (token_type in Text and not value.strip()):
+            if words and words[-1] != u" ":
+                words.append(u" ")
+        elif token_type in Keyword:
+            words.append(value.upper())
+        elif not literals and (token_type in String or token_type in Number):
+            words.append(u"?")
+        else:
+            words.append(value)
+    return u"".join(words).strip()
+
+
+def fingerprint(lexer, statement):
+    """ Reduce a statement to its shape, so that statements differing
+    only in their literal values compare equal.
+    """
+    return normalise(lexer, statement, literals=False)
+
+
+def may_write(statement):
+    """ Check whether a statement could possibly write, without lexing
+    it. A statement for which this returns :const:`False` certainly
+    does not write; otherwise, :func:`is_write` gives the answer.
+    """
+    return WRITE_HINT.search(statement) is not None
+
+
+def is_write(lexer, statement):
+    """ Check whether a statement may write to the database, going by
+    the words it contains outside of strings, comments and quoted names,
+    and by the names of any procedures it calls.
+    """
+    procedure = None
+    for token_type, value in lexer.get_tokens(statement):
+        if token_type in String or token_type in Comment or value.startswith(u"`"):
+            continue
+        word = value.strip()
+        if procedure is not None:
+            # Gather up the procedure name, which may be split into several tokens
+            if word and word != u"(" and not (procedure and token_type in Keyword):
+                procedure += word
+                continue
+            if procedure or word:
+                if procedure.lower() not in READ_PROCEDURES:
+                    return True
+                procedure = None
+        if word.upper() in WRITE_KEYWORDS:
+            return True
+        elif word.upper() == u"CALL":
+            procedure = u""
+    return procedure is not None and procedure.lower() not in READ_PROCEDURES
+
+
+class StatementReader(object):
+    """ Incremental reader for Cypher source.
+
+    Statements are split out as the underlying file is read, so only the
+    statement currently being assembled is ever held in memory. Iterating
+    yields a pair of (byte offset, statement) for each statement found,
+    where the offset marks the end of that statement within the file.
+
+    Source is scanned only once, with any open quote or comment carried
+    from one chunk to the next, so the cost of reading is linear in the
+    size of the file however long its statements are.
+    """
+
+    #: Number of bytes to read from the file at a time.
+    chunk_size = 65536
+
+    def __init__(self, f, offset=0, chunk_size=None):
+        self.file = f
+        self.offset = offset
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        self._state = None
+        self._significant = False
+        self._scanned = 0
+
+    def __iter__(self):
+        decoder = getincrementaldecoder("utf-8")()
+        read = getattr(self.file, "read1", self.file.read)
+        pieces = []
+        pending = u""
+        while True:
+            data = read(self.chunk_size)
+            at_end = not data
+            pending += decoder.decode(data, at_end)
+            start = 0
+            for end, significant in self._boundaries(pending, at_end):
+                pieces.append(pending[start:end])
+                text = u"".join(pieces)
+                pieces = []
+                self.offset += len(text.encode("utf-8"))
+                start = end
+                if significant:
+                    statement = text.strip()
+                    if statement.endswith(u";"):
+                        statement = statement[:-1].rstrip()
+                    yield self.offset, statement
+            # Anything not yet scanned is held back to be read along with the next chunk
+            pieces.append(pending[start:self._scanned])
+            pending = pending[self._scanned:]
+            if at_end:
+                break
+
+    def _boundaries(self, text, at_end):
+        """ Find the end of each complete statement within `text`,
+        carrying on from the state left by the previous chunk. Unless
+        `at_end` is set, anything after the last semicolon is assumed to
+        be incomplete, and a final character that may begin a longer
+        token is left unscanned.
+        """
+        state = self._state
+        position = 0
+        length = len(text)
+        while position < length:
+            if state is None:
+                match = CODE_TOKEN.search(text, position)
+                if match is None:
+                    position = length
+                    break
+                token = match.group()
+                if token == u";":
+                    yield match.end(), self._significant
+                    self._significant = False
+                elif token in QUOTES:
+                    state = token
+                    self._significant = True
+                elif token in CLOSING_TOKENS:
+                    state = token
+                elif token == u"/" and match.end() == length and not at_end:
+                    position = match.start()
+                    break
+                else:
+                    self._significant = True
+            else:
+                closing, pattern = CLOSING_TOKENS[state]
+                match = pattern.search(text, position)
+                if match is None:
+                    if state == u"/*" and text.endswith(u"*") and not at_end:
+                        position = length - 1
+                    else:
+                        position = length
+                    break
+                token = match.group()
+                if token == u"\\" and match.end() == length and not at_end:
+                    position = match.start()
+                    break
+                elif token == closing:
+                    state = None
+            position = match.end()
+        self._state = state
+        self._scanned = position
+        if at_end:
+            yield length, self._significant
+            self._significant = False
+
+
+class Checkpoint(object):
+    """ Record of progress through a playback file, held alongside that
+    file so that an interrupted run can be resumed.
+    """
+
+    def __init__(self, file_name):
+        self.name = expanduser(file_name) + ".checkpoint"
+
+    def load(self):
+        """ Load the checkpoint, if one exists.
+
+        :returns: triple of (byte offset, statement number, parameter
+                  declarations made so far)
+        """
+        try:
+            with open(self.name) as f:
+                data = json_load(f)
+        except IOError:
+            return 0, 0, []
+        else:
+            return data["offset"], data["statement"], data.get("parameters", [])
+
+    def save(self, offset, statement, parameters=()):
+        with open(self.name, "w") as f:
+            json_dump({"offset": offset, "statement": statement, "parameters": list(parameters)}, f)
+
+    def clear(self):
+        try:
+            remove(self.name)
+        except OSError:
+            pass
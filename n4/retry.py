@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from random import uniform
+from time import sleep
+from timeit import default_timer as timer
+
+from neo4j.v1 import CypherError, ServiceUnavailable, SessionExpired
+
+
+#: Transient errors that come from a deliberate act, and so are not retried.
+NON_RETRYABLE_CODES = {"Neo.TransientError.Transaction.Terminated",
+                       "Neo.TransientError.Transaction.LockClientStopped"}
+
+
+def is_retryable(error):
+    """ Check whether an error is one that might not recur if the work
+    that caused it were tried again.
+    """
+    if isinstance(error, CypherError):
+        return error.classification == "TransientError" and error.code not in NON_RETRYABLE_CODES
+    return isinstance(error, (ServiceUnavailable, SessionExpired))
+
+
+class RetryPolicy(object):
+    """ Policy for trying work again after a transient failure, such as a
+    deadlock or a change of cluster leader.
+
+    Work is retried up to `retries` times, waiting `delay` seconds before
+    the first retry and `factor` times longer before each one after,
+    with each wait varied randomly by up to `jitter` of itself. No retry
+    is started once `budget` seconds have passed since the first attempt.
+    """
+
+    retries = 2
+    delay = 0.1
+    factor = 2.0
+    jitter = 0.2
+    budget = 30.0
+
+    def __init__(self, retries=None, delay=None, factor=None, jitter=None, budget=None):
+        if retries is not None:
+            self.retries = int(retries)
+        if delay is not None:
+            self.delay = float(delay)
+        if factor is not None:
+            self.factor = float(factor)
+        if jitter is not None:
+            self.jitter = float(jitter)
+        if budget is not None:
+            self.budget = float(budget)
+
+    def __str__(self):
+        if not self.retries:
+            return u"no retries"
+        return u"up to {} retr{} within {}s, from {}s apart growing {}x with {:.0f}% jitter".format(
+            self.retries, "y" if self.retries == 1 else "ies", self.budget,
+            self.delay, self.factor, 100 * self.jitter)
+
+    def wait(self, error, retry_count, started):
+        """ Decide whether to retry after an error and, if so, wait until
+        it is time to do so.
+
+        :param error: the error raised by the last attempt
+        :param retry_count: number of retries made so far
+        :param started: time at which the first attempt was started
+        :returns: :const:`True` if the work should be retried
+        """
+        if retry_count >= self.retries or not is_retryable(error):
+            return False
+        delay = self.delay * self.factor ** retry_count
+        delay += uniform(-self.jitter, self.jitter) * delay
+        if timer() + delay - started > self.budget:
+            return False
+        sleep(delay)
+        return True
+
+    def runner(self, runner, reset=None):
+        """ Wrap a function used to run a statement so that the statement
+        is run again on failure, as allowed by this policy. The first
+        record is fetched before returning, so that failures are noticed
+        before any output is written.
+
+        :param runner: function used to run the statement
+        :param reset: function to call before each retry, if any
+        """
+        return RetryingRunner(self, runner, reset)
+
+
+class RetryingRunner(object):
+
+    def __init__(self, policy, runner, reset=None):
+        self.policy = policy
+        self.runner = runner
+        self.reset = reset
+        #: Number of retries made on the last call.
+        self.retries = 0
+        #: Seconds spent on failed attempts and waiting on the last call.
+        self.retry_time = 0.0
+
+    def __call__(self, statement, parameters):
+        self.retries = 0
+        self.retry_time = 0.0
+        t0 = timer()
+        while True:
+            t1 = timer()
+            try:
+                result = self.runner(statement, parameters)
+                result.peek()
+            except Exception as error:
+                if not self.policy.wait(error, self.retries, t0):
+                    raise
+                self.retries += 1
+                if self.reset is not None:
+                    self.reset()
+            else:
+                if self.retries:
+                    self.retry_time = t1 - t0
+                return result
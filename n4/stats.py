@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright 2011-2017, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from bisect import bisect_left
+from hashlib import sha1
+from json import dumps as json_dumps
+from threading import Event, Lock, Thread
+from timeit import default_timer as timer
+
+from .fileutil import atomic_write
+
+
+#: Upper bounds, in seconds, of the latency histogram buckets. A final
+#: bucket catches everything slower.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram(object):
+    """ Latency histogram with fixed buckets, as used by Prometheus.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """ Estimate a percentile as the upper bound of the bucket in
+        which it falls, or the maximum if that is lower.
+        """
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative(self):
+        """ Iterate through pairs of (upper bound, count of values no
+        greater than that bound), ending with an unbounded bucket.
+        """
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            yield bound, seen
+
+
+class FingerprintStats(object):
+    """ Statistics for all statements sharing a fingerprint.
+    """
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.id = sha1(fingerprint.encode("utf-8")).hexdigest()[:8]
+        self.errors = 0
+        self.records = 0
+        self.latency = Histogram()
+
+
+class SessionStats(object):
+    """ Running totals for a console session, with latency histograms
+    broken down by statement fingerprint.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.started = timer()
+        self.statements = 0
+        self.records = 0
+        self.rendered = 0
+        self.retries = 0
+        self.errors = {}
+        self.fingerprints = {}
+
+    def _get(self, fingerprint):
+        try:
+            return self.fingerprints[fingerprint]
+        except KeyError:
+            stats = self.fingerprints[fingerprint] = FingerprintStats(fingerprint)
+            return stats
+
+    def add(self, fingerprint, latency, records, rendered=0, retries=0):
+        """ Record a statement that succeeded.
+        """
+        with self._lock:
+            self.statements += 1
+            self.records += records
+            self.rendered += rendered
+            self.retries += retries
+            stats = self._get(fingerprint)
+            stats.records += records
+            stats.latency.add(latency)
+
+    def add_error(self, fingerprint, error, retries=0):
+        """ Record a statement that failed.
+        """
+        with self._lock:
+            self.statements += 1
+            self.retries += retries
+            name = error.__class__.__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+            self._get(fingerprint).errors += 1
+
+    @property
+    def error_count(self):
+        return sum(self.errors.values())
+
+    @property
+    def uptime(self):
+        return timer() - self.started
+
+    def ranked(self):
+        """ Statistics for each fingerprint, most total time first.
+        """
+        with self._lock:
+            return sorted(self.fingerprints.values(), key=lambda stats: stats.latency.sum, reverse=True)
+
+    def to_json(self):
+        fingerprints = []
+        for stats in self.ranked():
+            latency = stats.latency
+            fingerprints.append({
+                "id": stats.id,
+                "statement": stats.fingerprint,
+                "count": latency.count,
+                "errors": stats.errors,
+                "records": stats.records,
+                "sum": latency.sum,
+                "max": latency.max,
+                "p50": latency.percentile(50),
+                "p90": latency.percentile(90),
+                "p99": latency.percentile(99),
+                "buckets": [[bound if bound != float("inf") else "+Inf", count]
+                            for bound, count in latency.cumulative()],
+            })
+        return json_dumps({
+            "uptime": self.uptime,
+            "statements": self.statements,
+            "records": self.records,
+            "rendered": self.rendered,
+            "retries": self.retries,
+            "errors": dict(self.errors),
+            "fingerprints": fingerprints,
+        }, sort_keys=True)
+
+    def to_prometheus(self):
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append(u"# HELP {} {}".format(name, help_text))
+            lines.append(u"# TYPE {} {}".format(name, metric_type))
+            for suffix, labels, value in samples:
+                label_str = u",".join(u'{}="{}"'.format(key, label_value(value)) for key, value in labels)
+                lines.append(u"{}{}{} {}".format(name, suffix, u"{" + label_str + u"}" if label_str else u"",
+                                                 number_str(value)))
+
+        ranked = self.ranked()
+        metric(u"n4_uptime_seconds", u"gauge", u"Time since the session started.",
+               [(u"", (), self.uptime)])
+        metric(u"n4_statements_total", u"counter", u"Statements run.",
+               [(u"", (), self.statements)])
+        metric(u"n4_records_total", u"counter", u"Records returned.",
+               [(u"", (), self.records)])
+        metric(u"n4_rendered_characters_total", u"counter", u"Characters of result output written.",
+               [(u"", (), self.rendered)])
+        metric(u"n4_retries_total", u"counter", u"Retries after transient errors.",
+               [(u"", (), self.retries)])
+        metric(u"n4_errors_total", u"counter", u"Statements that failed, by error.",
+               [(u"", ((u"error", name),), count) for name, count in sorted(self.errors.items())])
+        metric(u"n4_statement_info", u"gauge", u"Statement text for each fingerprint.",
+               [(u"", ((u"fingerprint", stats.id), (u"statement", stats.fingerprint)), 1) for stats in ranked])
+        samples = []
+        for stats in ranked:
+            labels = ((u"fingerprint", stats.id),)
+            for bound, count in stats.latency.cumulative():
+                samples.append((u"_bucket", labels + ((u"le", number_str(bound)),), count))
+            samples.append((u"_sum", labels, stats.latency.sum))
+            samples.append((u"_count", labels, stats.latency.count))
+        metric(u"n4_statement_duration_seconds", u"histogram", u"Statement latency by fingerprint.", samples)
+        return u"\n".join(lines) + u"\n"
+
+    def export(self, file_name, fmt=None):
+        """ Write statistics to a file, replacing it in one step so that
+        readers never see part of it.
+
+        :param fmt: "json" or "prometheus", otherwise chosen by file extension
+        """
+        if fmt is None:
+            fmt = "json" if file_name.endswith(".json") else "prometheus"
+        text = self.to_json() + u"\n" if fmt == "json" else self.to_prometheus()
+        with atomic_write(file_name) as f:
+            f.write(text)
+
+
+class StatsExporter(object):
+    """ Background writer of session statistics at a regular interval.
+    """
+
+    def __init__(self, stats, file_name, interval, fmt=None):
+        self.stats = stats
+        self.file_name = file_name
+        self.interval = interval
+        self.fmt = fmt
+        self._stopped = Event()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.stats.export(self.file_name, self.fmt)
+            except (IOError, OSError):
+                pass
+
+
+def label_value(value):
+    return value.replace(u"\\", u"\\\\").replace(u"\n", u"\\n").replace(u'"', u'\\"')
+
+
+def number_str(value):
+    if value == float("inf"):
+        return u"+Inf"
+    elif isinstance(value, float):
+        return repr(value)
+    else:
+        return u"{}".format(value)
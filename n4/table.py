@@ -27,6 +27,7 @@ if sys.version_info >= (3,):
     STRING = str
     LIST = list
     MAP = dict
+    NUMBER = (int, float)
 else:
     BOOLEAN = bool
     INTEGER = (int, long)
@@ -35,14 +36,54 @@ else:
     STRING = unicode
     LIST = list
     MAP = dict
+    NUMBER = (int, long, float)
+
+#: Types of value whose text never spans more than one line.
+SCALAR = (BOOLEAN, INTEGER, FLOAT)
+
+#: Marker for the end of a shortened cell.
+ELLIPSIS = u"..."
+
+
+def is_tty(file=None):
+    """ Check whether `file` (or stdout if omitted) is attached to a terminal.
+    """
+    if file is None:
+        file = sys.stdout
+    try:
+        return file.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def emit(text, file=None, styled=True):
+    """ Write `text` to `file` (or stdout) in a single call.
+
+    Unstyled text bypasses click, and therefore any colour handling, and
+    is written directly to the stream.
+    """
+    if styled:
+        click.echo(text, file=file, nl=False)
+    else:
+        out = file or click.get_text_stream("stdout")
+        out.write(text)
+        out.flush()
 
 
 class TableValueSystem(object):
+    """ Encoding of values as cell text. Cells can be limited to a number
+    of characters per line and a number of lines, in which case only as
+    much of each value is encoded as will be shown.
+    """
 
     NULL = u""
     TRUE = u"true"
     FALSE = u"false"
 
+    def __init__(self, max_width=None, max_height=None):
+        self.max_width = max_width
+        self.max_height = max_height
+
     def encode(self, value):
         if value is None:
             return self.NULL
@@ -53,27 +94,149 @@ class TableValueSystem(object):
         else:
             return STRING(value)
 
+    def split(self, value):
+        """ Encode a value as a list of lines, of which there is always
+        at least one.
+        """
+        text = self.encode(value)
+        if value is None or isinstance(value, SCALAR):
+            # These never span more than one line
+            return [text]
+        return text.splitlines(False) or [text]
+
+    def clip(self, value):
+        """ Encode a value as a list of lines, shortened to fit within the
+        maximum cell width and height.
+
+        :returns: pair of (lines, whether the value was shortened)
+        """
+        max_width, max_height = self.max_width, self.max_height
+        if not max_width and not max_height:
+            return self.split(value), False
+        if max_width and max_height:
+            # Enough for every line to be full, so that any more is cut
+            text, shortened = self.preview(value, (max_width + 1) * max_height)
+        else:
+            text, shortened = self.encode(value), False
+        lines = text.splitlines(False) or [text]
+        if max_height and len(lines) > max_height:
+            del lines[max_height:]
+            shortened = True
+        if max_width:
+            width = max(max_width, len(ELLIPSIS))
+            for i, line in enumerate(lines):
+                if len(line) > width:
+                    lines[i] = line[:width - len(ELLIPSIS)] + ELLIPSIS
+                    shortened = True
+        else:
+            width = len(lines[-1]) + len(ELLIPSIS)
+        if shortened and not lines[-1].endswith(ELLIPSIS):
+            lines[-1] = lines[-1][:width - len(ELLIPSIS)] + ELLIPSIS
+        return lines, shortened
+
+    def preview(self, value, limit):
+        """ Encode the start of a value, up to `limit` characters. Long
+        strings are cut before encoding, and lists and maps are encoded
+        only as far as needed, so a preview of a large value costs
+        little more than one of a small value.
+
+        :returns: pair of (text, whether the text was cut short)
+        """
+        if isinstance(value, (LIST, MAP)):
+            pieces = []
+            self._preview_repr(value, pieces, limit)
+            text = u"".join(pieces)
+        elif isinstance(value, STRING):
+            text = value[:limit + 1]
+        else:
+            text = self.encode(value)
+        if len(text) > limit:
+            return text[:limit], True
+        return text, False
+
+    def _preview_repr(self, value, pieces, budget):
+        # Appends pieces of the repr of a value until the budget runs out,
+        # returning what is left of the budget
+        if budget < 0:
+            return budget
+        if isinstance(value, LIST):
+            pieces.append(u"[")
+            budget -= 1
+            for i, item in enumerate(value):
+                if budget < 0:
+                    return budget
+                if i:
+                    pieces.append(u", ")
+                    budget -= 2
+                budget = self._preview_repr(item, pieces, budget)
+            pieces.append(u"]")
+            return budget - 1
+        elif isinstance(value, MAP):
+            pieces.append(u"{")
+            budget -= 1
+            for i, (key, item) in enumerate(value.items()):
+                if budget < 0:
+                    return budget
+                if i:
+                    pieces.append(u", ")
+                    budget -= 2
+                budget = self._preview_repr(key, pieces, budget)
+                pieces.append(u": ")
+                budget = self._preview_repr(item, pieces, budget - 2)
+            pieces.append(u"}")
+            return budget - 1
+        elif isinstance(value, (STRING, BYTES)) and len(value) > budget:
+            text = repr(value[:budget + 1])
+        else:
+            text = repr(value)
+        if not isinstance(text, STRING):
+            text = text.decode("ascii")
+        pieces.append(text)
+        return budget - len(text)
+
     def size(self, value):
-        lines = self.encode(value).splitlines(False)
-        width = max(map(len, lines)) if lines else 0
-        height = len(lines)
-        return width, height
+        lines = self.split(value)
+        return max(map(len, lines)), len(lines)
+
+
+class TableColumn(object):
+    """ Cells of one column of a table, held as the first line of the
+    encoded text of each value, with a flag for each cell marking
+    whether it is right-aligned.
+    """
+
+    __slots__ = ["cells", "right"]
+
+    def __init__(self):
+        self.cells = []
+        self.right = bytearray()
 
 
 class Table(object):
+    """ Table of values, stored by column so that each value is encoded
+    only once and column widths are kept up to date as rows are added.
 
-    def __init__(self, keys, padding=1, field_separator=u"|", auto_align=True, header=1):
-        self._value_system = TableValueSystem()
+    Cells that span more than one line, and the styles of rows, are
+    rare and so are held separately, keyed by row. Cells can be limited
+    in width and height, with shortened cells listed in :attr:`shortened`.
+    """
+
+    def __init__(self, keys, padding=1, field_separator=u"|", auto_align=True, header=1,
+                 max_width=None, max_height=None):
+        self._value_system = TableValueSystem(max_width, max_height)
         self._keys = keys
-        self._widths = []
-        for key in keys:
-            width, _ = self._value_system.size(key)
-            self._widths.append(width)
+        self._widths = [self._value_system.size(key)[0] for key in keys]
         self._padding = padding
         self._field_separator = field_separator
         self._auto_align = auto_align
         self._header = header
-        self._rows = []
+        self._columns = [TableColumn() for _ in keys]
+        self._size = 0
+        self._heights = {}
+        self._overflow = {}
+        self._styles = {}
+        #: Pairs of (row, column) for each cell that was shortened to fit.
+        self.shortened = []
 
     @property
     def value_system(self):
@@ -84,61 +247,114 @@ class Table(object):
         return self._widths
 
     def size(self):
-        return len(self._rows)
+        return self._size
+
+    def append(self, values, style=None):
+        """ Add a row of values to the table.
 
-    def append(self, values):
-        row = TableRow(self, self._padding, self._field_separator, self._auto_align)
+        :param values: values to add
+        :param style: click style to apply to the cells of this row, if any
+        """
+        value_system = self._value_system
+        bounded = value_system.max_width or value_system.max_height
+        auto_align = self._auto_align
+        columns = self._columns
+        widths = self._widths
+        row = self._size
+        height = 1
+        column = -1
         for column, value in enumerate(values):
-            row.put(column, value)
-        self._rows.append(row)
+            if bounded:
+                lines, shortened = value_system.clip(value)
+                if shortened:
+                    self.shortened.append((row, column))
+            else:
+                lines = value_system.split(value)
+            text = lines[0]
+            cells = columns[column]
+            cells.cells.append(text)
+            cells.right.append(auto_align and type(value) in NUMBER)
+            width = len(text)
+            if len(lines) > 1:
+                self._overflow[row, column] = lines
+                width = max(map(len, lines))
+                height = max(height, len(lines))
+            if width > widths[column]:
+                widths[column] = width
+        for cells in columns[column + 1:]:
+            cells.cells.append(u"")
+            cells.right.append(0)
+        if height > 1:
+            self._heights[row] = height
+        if style:
+            self._styles[row] = style
+        self._size += 1
 
-    def echo(self, header_style):
+    def render(self, header_style=None, styled=True):
+        """ Render the table as a single string.
+
+        :param header_style: click style to apply to header cells, if any
+        :param styled: whether to apply header and row styles at all
+        :returns: rendered text, with a line terminator after each line
+        """
+        lines = []
         if self._header:
-            header_row = TableRow(self, self._padding, self._field_separator, self._auto_align)
-            for column, key in enumerate(self._keys):
-                header_row.put(column, key)
-            header_row.echo(**header_style)
-            click.secho(self._field_separator.join(u"-" * (self._widths[i] + 2 * self._padding)
-                                                   for i, key in enumerate(self._keys)),
-                        nl=False)
-            click.echo(u"\r\n", nl=False)
-        for row in self._rows:
-            row.echo()
-
-
-class TableRow(object):
-
-    def __init__(self, table, padding=1, field_separator=u"|", auto_align=True):
-        self._table = table
-        self._padding = padding
-        self._field_separator = field_separator
-        self._auto_align = auto_align
-        self._types = [None for _ in self._table.widths]
-        self._lines = [[u"" for _ in self._table.widths]]
-
-    def put(self, column, value):
-        self._types[column] = type(value)
-        lines = self._table.value_system.encode(value).splitlines(False)
-        width, height = self._table.value_system.size(value)
-        self._table.widths[column] = max(width, self._table.widths[column])
-        while height > len(self._lines):
-            self._lines.append([u"" for _ in self._table.widths])
-        for row, line in enumerate(lines):
-            self._lines[row][column] = line
-
-    def echo(self, **style):
+            lines.extend(self._render_lines([self._value_system.split(key) for key in self._keys],
+                                            bytearray(len(self._keys)), header_style if styled else None))
+            lines.append(self._field_separator.join(u"-" * (self._widths[i] + 2 * self._padding)
+                                                    for i, key in enumerate(self._keys)))
+        if not self._columns:
+            lines.extend(u"" for _ in range(self._size))
+        else:
+            # Pad each column in turn, then join the cells of each row,
+            # dealing separately with rows that are styled or span lines
+            padding = u" " * self._padding
+            padded = []
+            for cells, width in zip(self._columns, self._widths):
+                padded.append([padding + (text.rjust(width) if right else text.ljust(width)) + padding
+                               for text, right in zip(cells.cells, cells.right)])
+            padded[-1] = [cell.rstrip() for cell in padded[-1]]
+            separator = self._field_separator
+            styles = self._styles if styled else {}
+            if not styles and not self._heights:
+                lines.extend(map(separator.join, zip(*padded)))
+            else:
+                for row, cells in enumerate(zip(*padded)):
+                    style = styles.get(row)
+                    if row in self._heights:
+                        lines.extend(self._render_row(row, style))
+                    elif style:
+                        lines.append(separator.join(click.style(cell, **style) for cell in cells))
+                    else:
+                        lines.append(separator.join(cells))
+        lines.append(u"")
+        return u"\r\n".join(lines)
+
+    def _render_row(self, row, style=None):
+        overflow = self._overflow
+        return self._render_lines([overflow.get((row, column)) or [cells.cells[row]]
+                                   for column, cells in enumerate(self._columns)],
+                                  [cells.right[row] for cells in self._columns], style)
+
+    def _render_lines(self, cell_lines, right, style=None):
+        """ Render a row, given the lines of each cell, as a list of lines.
+        """
         padding = u" " * self._padding
-        for line in self._lines:
-            last_column = len(line) - 1
-            for column, text in enumerate(line):
-                if column > 0:
-                    click.secho(self._field_separator, nl=False)
-                if self._auto_align and (self._types[column] == INTEGER or self._types[column] == FLOAT):
-                    justified_text = text.rjust(self._table.widths[column])
-                else:
-                    justified_text = text.ljust(self._table.widths[column])
-                final_text = padding + justified_text + padding
-                if column == last_column:
-                    final_text = final_text.rstrip()
-                click.secho(final_text, nl=False, **style)
-            click.echo(u"\r\n", nl=False)
+        widths = self._widths
+        lines = []
+        for line_no in range(max(map(len, cell_lines)) if cell_lines else 1):
+            cells = []
+            for column, texts in enumerate(cell_lines):
+                text = texts[line_no] if line_no < len(texts) else u""
+                width = widths[column]
+                cells.append(padding + (text.rjust(width) if right[column] else text.ljust(width)) + padding)
+            if cells:
+                cells[-1] = cells[-1].rstrip()
+            if style:
+                cells = [click.style(cell, **style) for cell in cells]
+            lines.append(self._field_separator.join(cells))
+        return lines
+
+    def echo(self, header_style, file=None):
+        styled = is_tty(file)
+        emit(self.render(header_style, styled), file, styled)
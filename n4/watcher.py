@@ -19,8 +19,15 @@
 # limitations under the License.
 
 
+from collections import deque
 import logging
+import re
 from sys import stderr
+from threading import enumerate as enumerate_threads
+from timeit import default_timer as timer
+
+#: Pattern for client (C) and server (S) protocol messages in log output.
+PROTOCOL_MESSAGE = re.compile(r"(?:\[#([0-9A-F]+)\]\s+)?\b([CS]): (<?[A-Z_]+>?)")
 
 
 class ColourFormatter(logging.Formatter):
@@ -55,6 +62,8 @@ class Watcher(object):
         self.stop()
         handler = logging.StreamHandler(out)
         handler.setFormatter(self.formatter)
+        # The logger level may be lowered while tracing, so the handler keeps its own
+        handler.setLevel(level)
         self.handlers[self.logger_name] = handler
         self.logger.addHandler(handler)
         self.logger.setLevel(level)
@@ -77,3 +86,129 @@ def watch(logger_name, level=logging.INFO, out=stderr):
     watcher = Watcher(logger_name)
     watcher.watch(level, out)
     return watcher
+
+
+class TraceRecorder(logging.Handler):
+    """ Recorder for protocol activity, kept in memory for inspection
+    once the activity of interest is over.
+
+    The recorder is attached as a handler to the watched loggers, which
+    are set to log at debug level while it records. Each log record is
+    kept unformatted, with a timestamp, in a ring buffer of the most
+    recent `capacity` entries, so recording adds little to the cost of
+    the traffic recorded. Marks can be added to divide the trace up by
+    statement.
+    """
+
+    capacity = 100000
+
+    def __init__(self, logger_names=("neobolt", "neo4j.bolt"), capacity=None):
+        super(TraceRecorder, self).__init__(logging.DEBUG)
+        if capacity is not None:
+            self.capacity = int(capacity)
+        self.logger_names = logger_names
+        self.events = deque(maxlen=self.capacity)
+        self._levels = {}
+
+    def emit(self, record):
+        self.events.append((timer(), record.thread, record.msg, record.args))
+
+    def mark(self, label):
+        """ Mark the start of a new statement within the trace.
+        """
+        self.events.append((timer(), None, label, None))
+
+    def start(self):
+        for name in self.logger_names:
+            logger = logging.getLogger(name)
+            self._levels[name] = logger.level
+            logger.addHandler(self)
+            logger.setLevel(logging.DEBUG)
+
+    def stop(self):
+        for name in self.logger_names:
+            logger = logging.getLogger(name)
+            logger.removeHandler(self)
+            logger.setLevel(self._levels.pop(name, logging.NOTSET))
+
+    def clear(self):
+        self.events.clear()
+
+    def lines(self):
+        """ Iterate through the trace as lines of text, each timed in
+        milliseconds from the start of the trace.
+        """
+        events = list(self.events)
+        t0 = events[0][0] if events else 0.0
+        thread_names = dict((thread.ident, thread.name) for thread in enumerate_threads())
+        for t, thread, msg, args in events:
+            if thread is None:
+                yield u"{:12.3f}ms  --- {} ---".format(1000 * (t - t0), msg)
+            else:
+                yield u"{:12.3f}ms  {}  {}".format(1000 * (t - t0), thread_names.get(thread, thread),
+                                                   message_str(msg, args))
+
+    def summary(self):
+        """ Summarise the trace for each marked statement.
+
+        :returns: list of :class:`.StatementTrace` objects, the first of
+                  which covers any activity before the first mark
+        """
+        traces = [StatementTrace(None)]
+        directions = {}
+        for t, thread, msg, args in list(self.events):
+            if thread is None:
+                traces.append(StatementTrace(msg, t))
+                continue
+            trace = traces[-1]
+            trace.add_time(t)
+            message = message_str(msg, args)
+            match = PROTOCOL_MESSAGE.search(message)
+            if not match:
+                continue
+            connection, direction, name = match.groups()
+            trace.size += len(message) - match.start(3)
+            if direction == u"C":
+                trace.sent += 1
+            else:
+                trace.received += 1
+                if directions.get(connection) == u"C":
+                    trace.round_trips += 1
+                if name == u"RECORD":
+                    # Some drivers log a whole batch of records at a time
+                    count = args[-1] if u" * " in message and args else 1
+                    trace.records += count if isinstance(count, int) else 1
+            directions[connection] = direction
+        return [trace for trace in traces if trace.label is not None or trace.sent or trace.received]
+
+
+def message_str(msg, args):
+    try:
+        return msg % args if args else msg
+    except (TypeError, ValueError):
+        return u"{} {!r}".format(msg, args)
+
+
+class StatementTrace(object):
+    """ Protocol activity for a single statement.
+    """
+
+    def __init__(self, label, started=None):
+        self.label = label
+        self.started = started
+        self.finished = started
+        self.round_trips = 0
+        self.sent = 0
+        self.received = 0
+        self.records = 0
+        #: Approximate size of the messages, as logged
+        self.size = 0
+
+    def add_time(self, t):
+        if self.started is None:
+            self.started = t
+        self.finished = t
+
+    @property
+    def elapsed(self):
+        return (self.finished or 0.0) - (self.started or 0.0)